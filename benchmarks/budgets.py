@@ -0,0 +1,208 @@
+#
+# Copyright (c) 2015 Open-RnD Sp. z o.o.
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Call budgets of the web UI. The application runs against fake
+NetworkManager and camera controller services on a private bus (see
+dbusfixture.py), device controller is faked in-process. Operation counts
+of main routes, as reported in Server-Timing header, and of provider
+calls are checked against budgets. Budgets do not depend on the number
+of saved connections or cameras, hence an N+1 regression fails the
+check. Exits with status 1 if any budget is exceeded.
+
+Run from source tree root:
+
+  python benchmarks/budgets.py --connections 50 web-data
+"""
+
+from __future__ import absolute_import
+
+import os.path
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from ros3dui.web import Application
+from ros3dui.web.tracing import parse_server_timing
+from ros3dui.system import trace
+from ros3dui.system import rest_client
+from ros3dui.system.network import (network_provider, DETAIL_STATUS,
+                                    DETAIL_CONFIG)
+from ros3dui.system.camera import get_camera_manager, CameraStateCache
+from ros3dui.system.util import ConfigLoader
+from dbusfixture import PrivateBus
+from http_load import start_server
+from tornado.httpclient import AsyncHTTPClient
+from tornado.ioloop import IOLoop
+from tornado import gen
+import fakes
+import argparse
+import json
+import logging
+import time
+
+
+def route_budgets(devices):
+    """Budgets of main routes, route -> budget. Pages are served from
+    signal driven caches of providers, D-Bus calls are only made to
+    refresh devices that changed and to fetch WiFi secrets."""
+    return {
+        '/status': dict(dbus=devices, rest=0),
+        '/api/status': dict(dbus=devices, rest=0),
+        '/network_settings': dict(dbus=2 * devices, rest=0),
+        '/system_settings': dict(dbus=0, rest=0),
+        '/snapshots': dict(dbus=0, rest=1),
+        '/snapshot/1': dict(dbus=0, rest=1),
+    }
+
+
+# seconds to wait for provider caches to load
+SETTLE_DELAY = 1.0
+# camera state cache poll interval during the check, camera state loaded
+# by the first requests does not go stale, so that counts do not depend
+# on timing
+CAMERA_POLL_INTERVAL = 3600.0
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Ros3D Web UI call budgets')
+    parser.add_argument('--devices', default=2, type=int,
+                        help='Number of network devices, default: 2')
+    parser.add_argument('--connections', default=50, type=int,
+                        help='Number of saved connections, default: 50')
+    parser.add_argument('--cameras', default=4, type=int,
+                        help='Number of cameras, default: 4')
+    parser.add_argument('--config-path', default=None,
+                        help='Configuration file path')
+    parser.add_argument('-d', '--debug', action='store_true', default=False)
+    parser.add_argument('document_root', help='Document root')
+    return parser.parse_args()
+
+
+def check_providers(devices, failures):
+    """Check budgets of provider calls made by request handlers, failures
+    are appended to `failures`. Returns dict with results."""
+    provider = network_provider()
+    camera = get_camera_manager()
+    calls = [
+        ('list_interfaces_status', dict(dbus=devices),
+         lambda: provider.list_interfaces(DETAIL_STATUS)),
+        ('list_interfaces_config', dict(dbus=2 * devices),
+         lambda: provider.list_interfaces(DETAIL_CONFIG)),
+        ('camera_get_details', dict(dbus=0), camera.get_details),
+    ]
+
+    results = measure_calls(calls, failures)
+
+    # saving unchanged settings must neither update the connection nor
+    # apply it to the device, NetworkManager leaves settings at default
+    # values out of GetSettings(). The first save brings wired
+    # connections of the fixture to the saved configuration.
+    wired = {'wired': [{'ipv4': {'method': 'dhcp'}}]}
+    provider.set_config(wired)
+    results.update(measure_calls(
+        [('set_config_unchanged', dict(dbus=1),
+          lambda: provider.set_config(wired))], failures))
+    return results
+
+
+def measure_calls(calls, failures):
+    """Run `calls`, a list of (name, budget, callable), each within its
+    budget, failures are appended to `failures`. Returns dict with
+    results."""
+    results = {}
+    for name, budget, call in calls:
+        budget_context = trace.Budget(**budget)
+        try:
+            with budget_context:
+                call()
+        except trace.BudgetExceeded as err:
+            failures.append('{}: {}'.format(name, err))
+        results[name] = dict(counts=budget_context.trace.counts,
+                             budget=budget)
+    return results
+
+
+@gen.coroutine
+def check_routes(port, budgets, failures):
+    """Check `budgets` of routes, failures are appended to `failures`.
+    Returns dict with results."""
+    client = AsyncHTTPClient()
+    results = {}
+    for route, budget in sorted(budgets.items()):
+        url = 'http://127.0.0.1:{}{}'.format(port, route)
+        response = yield client.fetch(url, raise_error=False)
+        if response.code != 200:
+            failures.append('{}: status {}'.format(route, response.code))
+            continue
+        counts = parse_server_timing(response.headers.get('Server-Timing', ''))
+        try:
+            trace.check_budget(counts, **budget)
+        except trace.BudgetExceeded as err:
+            failures.append('{}: {}'.format(route, err))
+        results[route] = dict(counts=counts, budget=budget)
+    raise gen.Return(results)
+
+
+def main():
+    opts = parse_arguments()
+    logging.basicConfig(level=logging.DEBUG if opts.debug else logging.WARNING)
+
+    if opts.config_path:
+        ConfigLoader.set_config_location(opts.config_path)
+
+    failures = []
+    with PrivateBus(opts.devices, opts.connections, opts.cameras):
+        # network provider and camera manager connect to the private
+        # bus, only device controller is faked
+        rest_client._rest_client = fakes.FakeRestClient()
+        CameraStateCache.POLL_INTERVAL = CAMERA_POLL_INTERVAL
+        app = Application(opts.document_root)
+        port = start_server(app)
+
+        budgets = route_budgets(opts.devices)
+        # first requests load provider caches and templates
+        IOLoop.current().run_sync(lambda: check_routes(port, budgets, []))
+        time.sleep(SETTLE_DELAY)
+        # prime camera state cache, in case the initial load failed
+        get_camera_manager().get_details()
+
+        routes = IOLoop.current().run_sync(
+            lambda: check_routes(port, budgets, failures))
+        providers = check_providers(opts.devices, failures)
+
+    report = dict(devices=opts.devices,
+                  connections=opts.connections,
+                  cameras=opts.cameras,
+                  routes=routes,
+                  providers=providers,
+                  failures=failures)
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python2
+#
+# Copyright (c) 2015 Open-RnD Sp. z o.o.
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Benchmark of D-Bus access paths of network provider and camera
+manager, run against fake services on a private bus. Timings are
+printed as JSON.
+
+Run from source tree root, eg. 2 devices and 50 saved connections:
+
+  python benchmarks/dbus_bench.py --devices 2 --connections 50
+"""
+
+from __future__ import absolute_import
+
+import os.path
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from ros3dui.system.network import DETAIL_STATUS, DETAIL_CONFIG
+from dbusfixture import PrivateBus
+from http_load import percentile
+import argparse
+import json
+import logging
+import time
+
+
+def measure(fn, iterations):
+    """Call `fn` `iterations` times, returns dict with timings"""
+    timings = []
+    for _ in range(iterations):
+        start = time.time()
+        fn()
+        timings.append(time.time() - start)
+    timings.sort()
+
+    result = dict(iterations=iterations,
+                  mean_ms=sum(timings) / len(timings) * 1000.0)
+    for pct in [50, 95, 99]:
+        result['p%d_ms' % pct] = percentile(timings, pct) * 1000.0
+    return result
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Ros3D Web UI D-Bus benchmark')
+    parser.add_argument('--devices', default=2, type=int,
+                        help='Number of network devices, default: 2')
+    parser.add_argument('--connections', default=50, type=int,
+                        help='Number of saved connections, default: 50')
+    parser.add_argument('--cameras', default=2, type=int,
+                        help='Number of cameras, default: 2')
+    parser.add_argument('--no-object-manager', action='store_true',
+                        default=False,
+                        help='Fake NetworkManager without ObjectManager')
+    parser.add_argument('-n', '--iterations', default=100, type=int,
+                        help='Calls per measurement, default: 100')
+    parser.add_argument('--cached', action='store_true', default=False,
+                        help='Use signal driven caches of providers')
+    parser.add_argument('-d', '--debug', action='store_true', default=False)
+    return parser.parse_args()
+
+
+def main():
+    opts = parse_arguments()
+    logging.basicConfig(level=logging.DEBUG if opts.debug else logging.WARNING)
+
+    with PrivateBus(opts.devices, opts.connections, opts.cameras,
+                    object_manager=not opts.no_object_manager):
+        # providers connect to system bus, which is the private bus now
+        from ros3dui.system.network.networkmanager import (
+            NetworkManagerProvider, get_networkmanager_provider)
+        from ros3dui.system.camera import CameraManager, create_camera_manager
+
+        if opts.cached:
+            provider = get_networkmanager_provider()
+            camera = create_camera_manager()
+            # let caches load
+            time.sleep(1.0)
+        else:
+            provider = NetworkManagerProvider()
+            camera = CameraManager()
+
+        results = {
+            'list_interfaces_status': measure(
+                lambda: provider.list_interfaces(DETAIL_STATUS), opts.iterations),
+            'list_interfaces_config': measure(
+                lambda: provider.list_interfaces(DETAIL_CONFIG), opts.iterations),
+            'camera_get_details': measure(camera.get_details, opts.iterations),
+        }
+
+    report = dict(devices=opts.devices,
+                  connections=opts.connections,
+                  cameras=opts.cameras,
+                  object_manager=not opts.no_object_manager,
+                  cached=opts.cached,
+                  results=results)
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
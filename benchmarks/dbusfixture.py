@@ -0,0 +1,121 @@
+#
+# Copyright (c) 2015 Open-RnD Sp. z o.o.
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Private D-Bus daemon with fake NetworkManager and camera controller
+services (see fake_services.py). The daemon address is exported as
+DBUS_SYSTEM_BUS_ADDRESS, hence dbus.SystemBus() connections made after
+the fixture is started talk to the fakes. Usage:
+
+  with PrivateBus(devices=2, connections=50) as bus:
+      provider = NetworkManagerProvider()
+      ...
+"""
+
+from __future__ import absolute_import
+
+import dbus
+import logging
+import os.path
+import os
+import subprocess
+import sys
+import time
+
+_log = logging.getLogger(__name__)
+
+FAKE_SERVICES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'fake_services.py')
+
+SERVICE_NAMES = ['org.freedesktop.NetworkManager',
+                 'org.ros3d.CameraController']
+
+
+class PrivateBus(object):
+    """Private bus with fake services, `devices` network devices
+    (alternately wired and wireless), `connections` saved connections and
+    `cameras` cameras"""
+
+    START_TIMEOUT = 10.0
+
+    def __init__(self, devices=2, connections=2, cameras=2,
+                 object_manager=True):
+        self.args = ['--devices', str(devices),
+                     '--connections', str(connections),
+                     '--cameras', str(cameras)]
+        if not object_manager:
+            self.args.append('--no-object-manager')
+        self.daemon = None
+        self.services = None
+        self.address = None
+        self.saved_address = None
+
+    def start(self):
+        self.daemon = subprocess.Popen(['dbus-daemon', '--session',
+                                        '--nofork', '--print-address'],
+                                       stdout=subprocess.PIPE)
+        self.address = self.daemon.stdout.readline().strip()
+        _log.debug('private bus at %s', self.address)
+
+        self.services = subprocess.Popen([sys.executable, FAKE_SERVICES,
+                                          '--address', self.address] +
+                                         self.args)
+        self._wait_for_services()
+
+        self.saved_address = os.environ.get('DBUS_SYSTEM_BUS_ADDRESS')
+        os.environ['DBUS_SYSTEM_BUS_ADDRESS'] = self.address
+
+    def _wait_for_services(self):
+        bus = dbus.bus.BusConnection(self.address)
+        try:
+            deadline = time.time() + self.START_TIMEOUT
+            while not all(bus.name_has_owner(name) for name in SERVICE_NAMES):
+                if self.services.poll() is not None:
+                    raise RuntimeError('fake services exited with {}'.format(
+                        self.services.returncode))
+                if time.time() > deadline:
+                    raise RuntimeError('fake services did not start')
+                time.sleep(0.05)
+        finally:
+            bus.close()
+
+    def stop(self):
+        for proc in [self.services, self.daemon]:
+            if proc and proc.poll() is None:
+                proc.terminate()
+                proc.wait()
+        self.services = self.daemon = None
+
+        if self.saved_address is None:
+            os.environ.pop('DBUS_SYSTEM_BUS_ADDRESS', None)
+        else:
+            os.environ['DBUS_SYSTEM_BUS_ADDRESS'] = self.saved_address
+
+    def __enter__(self):
+        try:
+            self.start()
+        except Exception:
+            self.stop()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
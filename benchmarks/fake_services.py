@@ -0,0 +1,349 @@
+#!/usr/bin/env python2
+#
+# Copyright (c) 2015 Open-RnD Sp. z o.o.
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Fake NetworkManager and Ros3D camera controller services. Objects
+mimic the parts of the real services' D-Bus API used by ros3dui. Run by
+dbusfixture.PrivateBus, connected to a private bus."""
+
+from __future__ import absolute_import
+
+import dbus
+import dbus.service
+from dbus.mainloop.glib import DBusGMainLoop
+import glib
+import argparse
+import logging
+
+_log = logging.getLogger(__name__)
+
+OBJECT_MANAGER_IFACE = 'org.freedesktop.DBus.ObjectManager'
+
+NM_SERVICE_NAME = 'org.freedesktop.NetworkManager'
+NM_SERVICE_PATH = '/org/freedesktop/NetworkManager'
+NM_OBJECT_MANAGER_PATH = '/org/freedesktop'
+NM_SETTINGS_PATH = '/org/freedesktop/NetworkManager/Settings'
+NM_MANAGER_IFACE = 'org.freedesktop.NetworkManager'
+NM_SETTINGS_IFACE = 'org.freedesktop.NetworkManager.Settings'
+NM_CONNECTION_IFACE = 'org.freedesktop.NetworkManager.Settings.Connection'
+NM_DEVICE_IFACE = 'org.freedesktop.NetworkManager.Device'
+NM_DEVICE_WIRED_IFACE = 'org.freedesktop.NetworkManager.Device.Wired'
+NM_DEVICE_WIRELESS_IFACE = 'org.freedesktop.NetworkManager.Device.Wireless'
+NM_IP4CONFIG_IFACE = 'org.freedesktop.NetworkManager.IP4Config'
+NM_ACCESS_POINT_IFACE = 'org.freedesktop.NetworkManager.AccessPoint'
+
+CM_SERVICE_NAME = 'org.ros3d.CameraController'
+CM_SERVICE_PATH = '/org/ros3d/controller'
+CM_MANAGER_IFACE = 'org.ros3d.CameraController'
+CM_DEVICE_IFACE = 'org.ros3d.Camera'
+
+NM_DEVICE_TYPE_ETHERNET = 1
+NM_DEVICE_TYPE_WIFI = 2
+NM_DEVICE_STATE_ACTIVATED = 100
+
+
+def _ip(last):
+    """192.168.1.<last> as integer in network byte order, the way
+    NetworkManager reports addresses on little endian hosts"""
+    return dbus.UInt32(192 | 168 << 8 | 1 << 16 | last << 24)
+
+
+def _bytes(string):
+    return dbus.Array([dbus.Byte(ord(c)) for c in string], signature='y')
+
+
+class PropertiesObject(dbus.service.Object):
+    """Bus object with properties, `props` is a dict of interface name ->
+    dict of properties"""
+
+    def __init__(self, bus, path, props, registry):
+        dbus.service.Object.__init__(self, bus, path)
+        self.path = path
+        self.props = props
+        registry[path] = self
+
+    @dbus.service.method(dbus.PROPERTIES_IFACE, in_signature='s',
+                         out_signature='a{sv}')
+    def GetAll(self, iface):
+        return self.props.get(iface, {})
+
+    @dbus.service.method(dbus.PROPERTIES_IFACE, in_signature='ss',
+                         out_signature='v')
+    def Get(self, iface, name):
+        return self.props[iface][name]
+
+
+class ObjectManager(dbus.service.Object):
+    """ObjectManager exposing all objects in `registry` with path
+    prefixed by `root`"""
+
+    def __init__(self, bus, root, registry):
+        dbus.service.Object.__init__(self, bus, root)
+        self.root = root
+        self.registry = registry
+
+    @dbus.service.method(OBJECT_MANAGER_IFACE, out_signature='a{oa{sa{sv}}}')
+    def GetManagedObjects(self):
+        return dict((path, obj.props) for path, obj in self.registry.items()
+                    if path.startswith(self.root + '/'))
+
+
+class NetworkManager(PropertiesObject):
+
+    def __init__(self, bus, registry, devices):
+        PropertiesObject.__init__(self, bus, NM_SERVICE_PATH,
+                                  {NM_MANAGER_IFACE: {'Version': '1.0.0'}},
+                                  registry)
+        self.devices = devices
+
+    @dbus.service.method(NM_MANAGER_IFACE, out_signature='ao')
+    def GetDevices(self):
+        return [dbus.ObjectPath(path) for path in self.devices]
+
+
+class Settings(PropertiesObject):
+
+    def __init__(self, bus, registry):
+        PropertiesObject.__init__(self, bus, NM_SETTINGS_PATH,
+                                  {NM_SETTINGS_IFACE: {}}, registry)
+        self.bus = bus
+        self.registry = registry
+        self.connections = []
+
+    def add(self, settings, secrets):
+        path = '{}/{}'.format(NM_SETTINGS_PATH, len(self.connections) + 1)
+        while path in self.registry:
+            path += '0'
+        Connection(self, path, settings, secrets)
+        self.connections.append(path)
+        return path
+
+    def remove(self, path):
+        self.connections.remove(path)
+        self.registry.pop(path, None)
+        self.ConnectionRemoved(path)
+
+    @dbus.service.method(NM_SETTINGS_IFACE, out_signature='ao')
+    def ListConnections(self):
+        return [dbus.ObjectPath(path) for path in self.connections]
+
+    @dbus.service.method(NM_SETTINGS_IFACE, in_signature='a{sa{sv}}',
+                         out_signature='o')
+    def AddConnection(self, settings):
+        secrets = {}
+        security = settings.get('802-11-wireless-security', {})
+        if 'psk' in security:
+            secrets['802-11-wireless-security'] = {'psk': security.pop('psk')}
+        path = self.add(settings, secrets)
+        self.NewConnection(path)
+        return dbus.ObjectPath(path)
+
+    @dbus.service.signal(NM_SETTINGS_IFACE, signature='o')
+    def NewConnection(self, path):
+        pass
+
+    @dbus.service.signal(NM_SETTINGS_IFACE, signature='o')
+    def ConnectionRemoved(self, path):
+        pass
+
+
+# (section, key) -> default value of connection settings
+SETTING_DEFAULTS = {
+    ('connection', 'autoconnect'): True,
+}
+
+
+class Connection(PropertiesObject):
+
+    def __init__(self, settings, path, data, secrets):
+        PropertiesObject.__init__(self, settings.bus, path,
+                                  {NM_CONNECTION_IFACE: {}}, settings.registry)
+        self.settings = settings
+        self.data = data
+        self.secrets = secrets
+
+    @dbus.service.method(NM_CONNECTION_IFACE, out_signature='a{sa{sv}}')
+    def GetSettings(self):
+        # like NetworkManager, leave out settings at default values
+        return dict((section, dict((key, value)
+                                   for key, value in values.items()
+                                   if (section, key) not in SETTING_DEFAULTS or
+                                   SETTING_DEFAULTS[(section, key)] != value))
+                    for section, values in self.data.items())
+
+    @dbus.service.method(NM_CONNECTION_IFACE, in_signature='s',
+                         out_signature='a{sa{sv}}')
+    def GetSecrets(self, setting):
+        return dict((key, value) for key, value in self.secrets.items()
+                    if key == setting)
+
+    @dbus.service.method(NM_CONNECTION_IFACE, in_signature='a{sa{sv}}')
+    def Update(self, data):
+        security = data.get('802-11-wireless-security', {})
+        if 'psk' in security:
+            self.secrets['802-11-wireless-security'] = {'psk': security.pop('psk')}
+        self.data = data
+        self.Updated()
+
+    @dbus.service.method(NM_CONNECTION_IFACE)
+    def Delete(self):
+        self.Removed()
+        self.settings.remove(self.path)
+        self.remove_from_connection()
+
+    @dbus.service.signal(NM_CONNECTION_IFACE)
+    def Updated(self):
+        pass
+
+    @dbus.service.signal(NM_CONNECTION_IFACE)
+    def Removed(self):
+        pass
+
+
+def _connection_settings(idx, wireless):
+    ctype = '802-11-wireless' if wireless else '802-3-ethernet'
+    data = {
+        'connection': {'id': 'connection-%d' % idx,
+                       'uuid': '00000000-0000-0000-0000-%012d' % idx,
+                       'type': ctype},
+        'ipv4': {'method': 'auto'},
+        ctype: {},
+    }
+    secrets = {}
+    if wireless:
+        data[ctype] = {'ssid': _bytes('rig-ap-%d' % idx),
+                       'security': '802-11-wireless-security'}
+        data['802-11-wireless-security'] = {'key-mgmt': 'wpa-psk'}
+        secrets['802-11-wireless-security'] = {'psk': 'secret-%d' % idx}
+    return data, secrets
+
+
+def export_network_manager(bus, devices, connections, object_manager):
+    """Export NetworkManager with `devices` devices, alternately wired and
+    wireless, and `connections` saved connections of both types"""
+    registry = {}
+    if object_manager:
+        ObjectManager(bus, NM_OBJECT_MANAGER_PATH, registry)
+
+    devpaths = []
+    for idx in range(devices):
+        wireless = idx % 2 == 1
+        devpath = '{}/Devices/{}'.format(NM_SERVICE_PATH, idx)
+        ip4path = '{}/IP4Config/{}'.format(NM_SERVICE_PATH, idx)
+        PropertiesObject(bus, ip4path, {NM_IP4CONFIG_IFACE: {
+            'Addresses': dbus.Array([dbus.Array([_ip(10 + idx), dbus.UInt32(24),
+                                                 _ip(1)], signature='u')],
+                                    signature='au'),
+        }}, registry)
+
+        props = {
+            NM_DEVICE_IFACE: {
+                'Interface': 'wlan%d' % idx if wireless else 'eth%d' % idx,
+                'DeviceType': dbus.UInt32(NM_DEVICE_TYPE_WIFI if wireless
+                                          else NM_DEVICE_TYPE_ETHERNET),
+                'State': dbus.UInt32(NM_DEVICE_STATE_ACTIVATED),
+                'Ip4Config': dbus.ObjectPath(ip4path),
+                'Dhcp4Config': dbus.ObjectPath(
+                    '{}/DHCP4Config/{}'.format(NM_SERVICE_PATH, idx)),
+            },
+        }
+        hwaddr = '00:11:22:33:44:%02x' % idx
+        if wireless:
+            appath = '{}/AccessPoint/{}'.format(NM_SERVICE_PATH, idx)
+            PropertiesObject(bus, appath, {NM_ACCESS_POINT_IFACE: {
+                'Ssid': _bytes('rig-ap-%d' % idx),
+                'Strength': dbus.Byte(70),
+            }}, registry)
+            props[NM_DEVICE_WIRELESS_IFACE] = {
+                'HwAddress': hwaddr,
+                'ActiveAccessPoint': dbus.ObjectPath(appath),
+                'Bitrate': dbus.UInt32(54000),
+            }
+        else:
+            props[NM_DEVICE_WIRED_IFACE] = {'HwAddress': hwaddr}
+        PropertiesObject(bus, devpath, props, registry)
+        devpaths.append(devpath)
+
+    NetworkManager(bus, registry, devpaths)
+    settings = Settings(bus, registry)
+    for idx in range(connections):
+        settings.add(*_connection_settings(idx, idx % 2 == 1))
+
+
+class CameraController(ObjectManager):
+
+    def __init__(self, bus, registry):
+        ObjectManager.__init__(self, bus, CM_SERVICE_PATH, registry)
+        self.cameras = []
+
+    @dbus.service.method(CM_MANAGER_IFACE, out_signature='ao')
+    def listCameras(self):
+        return [dbus.ObjectPath(path) for path in self.cameras]
+
+
+def export_camera_controller(bus, cameras):
+    """Export camera controller with `cameras` cameras"""
+    registry = {}
+    controller = CameraController(bus, registry)
+    for idx in range(cameras):
+        path = '{}/camera{}'.format(CM_SERVICE_PATH, idx)
+        PropertiesObject(bus, path, {CM_DEVICE_IFACE: {
+            'Id': 'camera-%d' % idx,
+            'State': dbus.Int32(1),
+        }}, registry)
+        controller.cameras.append(path)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Fake NetworkManager and camera controller')
+    parser.add_argument('--address', required=True, help='Bus address')
+    parser.add_argument('--devices', default=2, type=int)
+    parser.add_argument('--connections', default=2, type=int)
+    parser.add_argument('--cameras', default=2, type=int)
+    parser.add_argument('--no-object-manager', action='store_true',
+                        default=False,
+                        help='Do not export ObjectManager for NetworkManager')
+    return parser.parse_args()
+
+
+def main():
+    opts = parse_arguments()
+    logging.basicConfig(level=logging.WARNING)
+
+    DBusGMainLoop(set_as_default=True)
+    bus = dbus.bus.BusConnection(opts.address)
+
+    export_network_manager(bus, opts.devices, opts.connections,
+                           not opts.no_object_manager)
+    export_camera_controller(bus, opts.cameras)
+
+    # names are requested last, fixture waits for them to appear,
+    # keep references or the names are released
+    names = [dbus.service.BusName(NM_SERVICE_NAME, bus),
+             dbus.service.BusName(CM_SERVICE_NAME, bus)]
+
+    glib.MainLoop().run()
+
+
+if __name__ == '__main__':
+    main()
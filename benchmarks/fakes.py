@@ -0,0 +1,127 @@
+#
+# Copyright (c) 2015 Open-RnD Sp. z o.o.
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""In-process stand-ins for network provider, camera manager and device
+controller REST client. Each one sleeps for `latency` seconds per call
+to simulate D-Bus or HTTP round trip."""
+
+from __future__ import absolute_import
+
+from ros3dui.system import registry as registry_module
+from ros3dui.system import rest_client
+from ros3dui.system.util import ConfigLoader
+from tornado import gen
+import json
+import time
+
+
+def _interface(itype, device, online=True):
+    ipv4 = dict(address='192.168.1.10', netmask='255.255.255.0',
+                gateway='192.168.1.1', method='dhcp')
+    iface = dict(type=itype, device=device, mac='00:11:22:33:44:55',
+                 online=online, name='Wired' if itype == 'wired' else 'rig-ap',
+                 ipv4=ipv4, ipv4conf=dict(ipv4), wificonf=None)
+    if itype == 'wireless':
+        iface['wificonf'] = {'name': 'rig-ap', 'wpa-psk': 'secret'}
+    return iface
+
+
+class FakeNetworkProvider(object):
+    """Network provider with one wired and one wireless interface"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def reconnect(self):
+        pass
+
+    def list_interfaces(self, detail=None):
+        # called from worker threads, blocking just like D-Bus calls
+        time.sleep(self.latency)
+        return {
+            'wired': [_interface('wired', 'eth0')],
+            'wireless': [_interface('wireless', 'wlan0')],
+        }
+
+    def set_config(self, config):
+        time.sleep(self.latency)
+
+
+class FakeCameraManager(object):
+    """Camera manager reporting `count` cameras"""
+
+    def __init__(self, latency=0.0, count=2):
+        self.latency = latency
+        self.cameras = [dict(name='camera-%d' % idx, value=1)
+                        for idx in range(count)]
+
+    def reconnect(self):
+        pass
+
+    def get_details(self):
+        time.sleep(self.latency)
+        return list(self.cameras)
+
+    @gen.coroutine
+    def get_details_async(self):
+        yield gen.sleep(self.latency)
+        raise gen.Return(list(self.cameras))
+
+
+SNAPSHOT = json.dumps(dict(
+    ('param_%d' % idx, dict(status=dict(read=True, write=True,
+                                        status='software'),
+                            type='float', value=float(idx)))
+    for idx in range(64)))
+
+
+class FakeRestClient(object):
+    """Device controller REST client holding `count` snapshots"""
+
+    def __init__(self, latency=0.0, count=10):
+        self.latency = latency
+        self.rest_url = ConfigLoader.snapshot().get_rest_url()
+        self.snapshots = range(1, count + 1)
+
+    @gen.coroutine
+    def get_snapshots_list(self, timeout=None):
+        yield gen.sleep(self.latency)
+        raise gen.Return(list(self.snapshots))
+
+    @gen.coroutine
+    def get_snapshot(self, snapshot_id, timeout=None):
+        yield gen.sleep(self.latency)
+        raise gen.Return(SNAPSHOT)
+
+    @gen.coroutine
+    def delete_snapshots(self, timeout=None):
+        yield gen.sleep(self.latency)
+
+
+def install(latency=0.0):
+    """Replace backends used by the application with fakes, each with
+    `latency` seconds delay per call"""
+    registry = registry_module.registry
+    with registry.lock:
+        registry.network = FakeNetworkProvider(latency)
+        registry.camera = FakeCameraManager(latency)
+    rest_client._rest_client = FakeRestClient(latency)
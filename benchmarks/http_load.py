@@ -0,0 +1,180 @@
+#!/usr/bin/env python2
+#
+# Copyright (c) 2015 Open-RnD Sp. z o.o.
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""HTTP load benchmark of the web UI. The application runs in a
+background thread with fake backends (see fakes.py), load is generated
+from the main thread. Results, throughput and latency percentiles per
+route, are printed as JSON.
+
+Run from source tree root:
+
+  python benchmarks/http_load.py --latency 0.01 web-data > baseline.json
+"""
+
+from __future__ import absolute_import
+
+import os.path
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from ros3dui.web import Application
+from ros3dui.system.util import ConfigLoader
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
+from tornado import gen
+import fakes
+import argparse
+import json
+import logging
+import threading
+import time
+
+ROUTES = ['/status', '/network_settings', '/system_settings',
+          '/snapshots', '/snapshot/1']
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Ros3D Web UI HTTP load benchmark')
+    parser.add_argument('-n', '--requests', default=500, type=int,
+                        help='Requests per route, default: 500')
+    parser.add_argument('-c', '--concurrency', default=10, type=int,
+                        help='Concurrent requests, default: 10')
+    parser.add_argument('-l', '--latency', default=0.0, type=float,
+                        help='Latency of fake backends in seconds, default: 0')
+    parser.add_argument('-r', '--route', action='append', dest='routes',
+                        help='Route to load, may be repeated, ' \
+                        'default: {}'.format(', '.join(ROUTES)))
+    parser.add_argument('--production', action='store_true', default=False,
+                        help='Run application with production profile')
+    parser.add_argument('--config-path', default=None,
+                        help='Configuration file path')
+    parser.add_argument('-d', '--debug', action='store_true', default=False)
+    parser.add_argument('document_root', help='Document root')
+    return parser.parse_args()
+
+
+def start_server(app):
+    """Start serving `app` from a background thread, returns port
+    number"""
+    sockets = bind_sockets(0, '127.0.0.1')
+    port = sockets[0].getsockname()[1]
+    started = threading.Event()
+
+    def _serve():
+        loop = IOLoop()
+        loop.make_current()
+        server = HTTPServer(app)
+        server.add_sockets(sockets)
+        loop.add_callback(started.set)
+        loop.start()
+
+    thread = threading.Thread(target=_serve, name='server')
+    thread.daemon = True
+    thread.start()
+    started.wait()
+    return port
+
+
+def percentile(values, pct):
+    """Percentile `pct` of sorted `values`, nearest rank"""
+    if not values:
+        return None
+    rank = int(round(pct / 100.0 * len(values) + 0.5)) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+@gen.coroutine
+def load_route(client, url, requests, concurrency):
+    """Issue `requests` GET requests to `url`, at most `concurrency` at a
+    time. Returns a dict with results."""
+    latencies = []
+    errors = [0]
+    remaining = [requests]
+
+    @gen.coroutine
+    def _worker():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            start = time.time()
+            response = yield client.fetch(url, raise_error=False)
+            latencies.append(time.time() - start)
+            if response.code != 200:
+                errors[0] += 1
+
+    start = time.time()
+    yield [_worker() for _ in range(concurrency)]
+    elapsed = time.time() - start
+
+    latencies.sort()
+    result = dict(requests=requests,
+                  errors=errors[0],
+                  elapsed=elapsed,
+                  throughput=requests / elapsed)
+    for pct in [50, 95, 99]:
+        result['p%d_ms' % pct] = percentile(latencies, pct) * 1000.0
+    raise gen.Return(result)
+
+
+@gen.coroutine
+def run(port, routes, requests, concurrency):
+    client = AsyncHTTPClient(max_clients=concurrency)
+    results = {}
+    for route in routes:
+        url = 'http://127.0.0.1:{}{}'.format(port, route)
+        # warm up template and page caches
+        yield client.fetch(url, raise_error=False)
+        results[route] = yield load_route(client, url, requests, concurrency)
+    raise gen.Return(results)
+
+
+def main():
+    opts = parse_arguments()
+
+    logging.basicConfig(level=logging.DEBUG if opts.debug else logging.WARNING)
+
+    if opts.config_path:
+        ConfigLoader.set_config_location(opts.config_path)
+
+    fakes.install(opts.latency)
+    app = Application(opts.document_root, production=opts.production)
+    port = start_server(app)
+
+    routes = opts.routes or ROUTES
+    results = IOLoop.current().run_sync(
+        lambda: run(port, routes, opts.requests, opts.concurrency))
+
+    report = dict(latency=opts.latency,
+                  concurrency=opts.concurrency,
+                  production=opts.production,
+                  routes=results)
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
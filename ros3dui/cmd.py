@@ -23,14 +23,33 @@
 
 from __future__ import absolute_import
 from ros3dui.web import Application
-from ros3dui.system.util import ConfigLoader
+from ros3dui.web.status import SharedStatusCollector
+from ros3dui.web.stalls import StallDetector
+from ros3dui.system.util import ConfigLoader, prepare_state_dir
 from ros3dui.system.services import ServiceReloader
+from ros3dui.system.rest_client import configure_http_client
 from tornado.ioloop import IOLoop
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+from tornado import process
 import logging
 import argparse
+import os.path
 
 
 DEFAULT_LISTEN_PORT = 9900
+DEFAULT_STATE_DIR = '/run/ros3d-ui'
+DEFAULT_ASSET_CACHE = '/var/cache/ros3d-ui/assets'
+
+PROFILE_DEVELOPMENT = 'development'
+PROFILE_PRODUCTION = 'production'
+
+
+def _positive_float(value):
+    value = float(value)
+    if value <= 0:
+        raise argparse.ArgumentTypeError('must be greater than 0')
+    return value
 
 
 def parse_arguments():
@@ -46,6 +65,30 @@ def parse_arguments():
                         default=None)
     parser.add_argument('--helpers-dir', help='Path to helper tools directory',
                         default=None)
+    parser.add_argument('--precompile-templates', action='store_true',
+                        default=False,
+                        help='Compile all templates at startup')
+    parser.add_argument('--profile', default=PROFILE_DEVELOPMENT,
+                        choices=[PROFILE_DEVELOPMENT, PROFILE_PRODUCTION],
+                        help='Runtime profile, production disables autoreload, ' \
+                        'debug mode and template modification checks, ' \
+                        'default: {}'.format(PROFILE_DEVELOPMENT))
+    parser.add_argument('--workers', default=1, type=int,
+                        help='Number of HTTP worker processes (production ' \
+                        'profile only), default: 1')
+    parser.add_argument('--state-dir', default=DEFAULT_STATE_DIR,
+                        help='Private directory for state shared by ' \
+                        'workers, default: {}'.format(DEFAULT_STATE_DIR))
+    parser.add_argument('--asset-cache', default=DEFAULT_ASSET_CACHE,
+                        help='Directory for compressed variants of static ' \
+                        'files, empty to serve files uncompressed, ' \
+                        'default: {}'.format(DEFAULT_ASSET_CACHE))
+    parser.add_argument('--trace-footer', action='store_true', default=False,
+                        help='Append request trace to HTML pages')
+    parser.add_argument('--stall-threshold', type=_positive_float,
+                        default=None,
+                        help='Log IOLoop callbacks blocking for longer than ' \
+                        'this many seconds, see /debug/stalls')
     parser.add_argument('-i', '--ia', help="Set if running on Image Analyser", action="store_true")
     parser.add_argument('document_root', help='Document root')
     return parser.parse_args()
@@ -71,14 +114,57 @@ def main():
     if opts.helpers_dir:
         ServiceReloader.set_helpers_dir(opts.helpers_dir)
 
+    production = opts.profile == PROFILE_PRODUCTION
+    if opts.workers < 1 or (opts.workers > 1 and not production):
+        logging.error('multiple workers need production profile')
+        raise SystemExit(1)
+
+    configure_http_client()
+
+    mode = Application.MODE_KR
     if opts.ia:
         logging.error('Image Analyzer mode')
-        app = Application(opts.document_root, mode=Application.MODE_AO)
-    else:
-        app = Application(opts.document_root)
+        mode = Application.MODE_AO
+
+    # templates and static assets are prepared once, before forking
+    app = Application(opts.document_root, mode=mode,
+                      precompile_templates=opts.precompile_templates,
+                      production=production,
+                      trace_footer=opts.trace_footer,
+                      asset_cache=opts.asset_cache)
 
     logging.debug('listening on port %d', opts.http_port)
-    app.listen(opts.http_port)
+    sockets = bind_sockets(opts.http_port)
+
+    if opts.workers > 1:
+        try:
+            prepare_state_dir(opts.state_dir)
+        except (OSError, RuntimeError) as err:
+            logging.error('cannot use state directory %s: %s',
+                          opts.state_dir, err)
+            raise SystemExit(1)
+
+        # D-Bus connections and GLib main loop thread are set up
+        # lazily, on first use, hence only after forking
+        process.fork_processes(opts.workers)
+        worker = process.task_id()
+        logging.debug('worker %d started', worker)
+
+        ServiceReloader.share_jobs(opts.state_dir, worker, opts.workers)
+        collector = SharedStatusCollector(app,
+                                          os.path.join(opts.state_dir,
+                                                       'status.json'),
+                                          writer=worker == 0)
+        app.set_status_collector(collector)
+        collector.start()
+
+    server = HTTPServer(app)
+    server.add_sockets(sockets)
+    app.metrics.start()
+
+    if opts.stall_threshold is not None:
+        app.stall_detector = StallDetector(opts.stall_threshold)
+        app.stall_detector.start()
 
     logging.debug('starting...')
     IOLoop.instance().start()
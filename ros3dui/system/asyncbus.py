@@ -0,0 +1,142 @@
+#
+# Copyright (c) 2015 Open-RnD Sp. z o.o.
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Bridge between D-Bus and Tornado IOLoop. D-Bus method calls are
+issued asynchronously with reply and error handlers, replies are
+dispatched by GLib main loop thread and passed back to the IOLoop as
+resolved futures. Code using synchronous D-Bus calls (ex. network and
+camera backends) is run in a small pool of worker threads, so that the
+IOLoop never waits for the bus."""
+
+from __future__ import absolute_import
+
+from ros3dui.system import mainloop
+from ros3dui.system import trace
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+import logging
+import sys
+import threading
+import time
+import Queue
+
+_log = logging.getLogger(__name__)
+
+# timeout of asynchronous D-Bus calls, in seconds
+DEFAULT_CALL_TIMEOUT = 10.0
+
+# number of threads running blocking calls
+WORKERS_COUNT = 4
+
+
+def _resolve(io_loop, future, result):
+    io_loop.add_callback(future.set_result, result)
+
+
+def _reject(io_loop, future, exc_info):
+    io_loop.add_callback(future.set_exc_info, exc_info)
+
+
+def call_async(method, *args, **kwargs):
+    """Call D-Bus method `method` (a bound method of a proxy object)
+    asynchronously. Returns a future resolved with method's return
+    value. Call timeout in seconds may be passed as `timeout`."""
+    mainloop.start()
+
+    io_loop = IOLoop.current()
+    future = Future()
+    timeout = kwargs.pop('timeout', DEFAULT_CALL_TIMEOUT)
+    # called from GLib thread, record with the trace of calling request
+    request_trace = trace.current()
+    name = kwargs.get('dbus_interface', getattr(method, 'interface', None))
+    start = time.time()
+
+    def _record(error):
+        with trace.activate(request_trace):
+            trace.record(trace.DBUS, name, time.time() - start, error)
+
+    def _reply(*result):
+        _record(False)
+        if len(result) == 0:
+            result = None
+        elif len(result) == 1:
+            result = result[0]
+        _resolve(io_loop, future, result)
+
+    def _error(error):
+        _record(True)
+        try:
+            raise error
+        except Exception:
+            _reject(io_loop, future, sys.exc_info())
+
+    method(*args, reply_handler=_reply, error_handler=_error,
+           timeout=timeout, **kwargs)
+    return future
+
+
+class _Workers(object):
+    """Pool of threads running blocking calls"""
+
+    def __init__(self, count):
+        self.count = count
+        self.queue = Queue.Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def _start(self):
+        with self.lock:
+            if self.threads:
+                return
+            for idx in range(self.count):
+                thread = threading.Thread(target=self._run,
+                                          name='bus-worker-%d' % (idx))
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def _run(self):
+        while True:
+            io_loop, future, request_trace, fn, args, kwargs = self.queue.get()
+            try:
+                with trace.activate(request_trace):
+                    result = fn(*args, **kwargs)
+            except Exception:
+                _reject(io_loop, future, sys.exc_info())
+            else:
+                _resolve(io_loop, future, result)
+
+    def submit(self, fn, *args, **kwargs):
+        self._start()
+        future = Future()
+        self.queue.put((IOLoop.current(), future, trace.current(),
+                        fn, args, kwargs))
+        return future
+
+
+_workers = _Workers(WORKERS_COUNT)
+
+
+def run_blocking(fn, *args, **kwargs):
+    """Run `fn` with arguments in one of worker threads. Returns a future
+    resolved with `fn` return value or exception."""
+    return _workers.submit(fn, *args, **kwargs)
@@ -24,9 +24,14 @@
 from __future__ import absolute_import
 
 import dbus
-import glib
-from dbus.mainloop.glib import DBusGMainLoop
+from ros3dui.system import mainloop
+from ros3dui.system.asyncbus import call_async, run_blocking
+from ros3dui.system.dbusaccess import BusAccess
+from tornado import gen
+from tornado.ioloop import IOLoop
 import logging
+import threading
+import time
 
 _log = logging.getLogger(__name__)
 
@@ -35,18 +40,6 @@ class CameraManagerError(Exception):
         pass
 
 
-class PropertiesWrapper(object):
-    def __init__(self, busobj):
-        _log.debug('properties wrapper for %s @ %s',
-                   busobj.dbus_interface, busobj.object_path)
-        self.busobj = busobj
-
-    def __getattr__(self, key):
-        _log.debug('get property %s', key)
-        return self.busobj.Get(self.busobj.dbus_interface,
-                               key,
-                               dbus_interface=dbus.PROPERTIES_IFACE)
-
 class CameraManager(object):
 
     CM_SERVICE_NAME = 'org.ros3d.CameraController'
@@ -54,52 +47,265 @@ class CameraManager(object):
     CM_MANAGER_IFACE = 'org.ros3d.CameraController'
     CM_DEVICE_IFACE = 'org.ros3d.Camera'
 
-    def __init__(self):
+    def __init__(self, state_cache=None):
         self.bus = dbus.SystemBus()
+        self.access = BusAccess(self.bus, self.CM_SERVICE_NAME)
         # proxy to camera controller iface
         self.cm = None
+        # CameraStateCache, if set, camera details are served from
+        # the cache
+        self.state_cache = state_cache
 
     def _connect(self):
-        cmobj = self.bus.get_object(self.CM_SERVICE_NAME,
-                self.CM_SERVICE_PATH)
-        self.cm = dbus.Interface(cmobj, self.CM_MANAGER_IFACE)
+        self.cm = self.access.get_iface(self.CM_SERVICE_PATH,
+                                        self.CM_MANAGER_IFACE)
+
+    def reconnect(self):
+        """Drop proxies after camera controller service was restarted"""
+        _log.info('reconnecting to camera controller')
+        self.access.reset()
+        self.cm = None
+        if self.state_cache:
+            self.state_cache.invalidate()
 
     def _get_bus_iface(self, devpath, iface):
         """Get proxy to interface and proxy for accessing interface properties
         for bus object at path `devpath` and interface `iface`
         """
-        devobj = self.bus.get_object(self.CM_SERVICE_NAME,
-                                    devpath)
-        dev = dbus.Interface(devobj, iface)
-        return dev, PropertiesWrapper(dev)
+        dev = self.access.get_iface(devpath, iface)
+        return dev, self.access.get_properties_wrapper(devpath, iface)
 
     def _get_device(self, devpath):
         """Proxy to device interface and it's properties"""
         return self._get_bus_iface(devpath,
                                    self.CM_DEVICE_IFACE)
 
+    def _fetch_camera(self, devpath):
+        """Get (id, state) of camera at `devpath`"""
+        props = self.access.get_properties(devpath, self.CM_DEVICE_IFACE)
+        return props['Id'], props['State']
+
+    def list_cameras(self):
+        """Get a list of (path, id, state) tuples of all cameras known to
+        the controller"""
+        if not self.cm:
+            self._connect()
+        with self.access.snapshot(self.CM_SERVICE_PATH):
+            devices = self.cm.listCameras()
+            _log.debug('devices: %s', devices)
+            return [(devpath,) + self._fetch_camera(devpath)
+                    for devpath in devices]
+
     def get_details(self):
+        if self.state_cache:
+            if self.state_cache.is_stale():
+                self.state_cache.reload()
+            return self.state_cache.get()
+
         try:
             self._connect()
             assert self.cm != None
 
-            devices = self.cm.listCameras()
-            _log.debug('devices: %s', devices)
-            camera_data = []
-            for devpath in devices:
-                _, props = self._get_device(devpath)
-                _log.debug('dev id: %s', props.Id)
-                _log.debug('device state: %d', props.State)
-                cam = dict(name=props.Id, value=props.State)
-                camera_data.append(cam)
+            with self.access.snapshot(self.CM_SERVICE_PATH):
+                devices = self.cm.listCameras()
+                _log.debug('devices: %s', devices)
+                camera_data = []
+                for devpath in devices:
+                    _, props = self._get_device(devpath)
+                    _log.debug('dev id: %s', props.Id)
+                    _log.debug('device state: %d', props.State)
+                    cam = dict(name=props.Id, value=props.State)
+                    camera_data.append(cam)
         except dbus.exceptions.DBusException, error:
             _log.error('camera controller service unavaialble, error: %s', error)
             raise CameraManagerError('Camera Controller service unavailable')
         return camera_data
 
+    @gen.coroutine
+    def get_details_async(self):
+        """Same as get_details(), but all calls are asynchronous and
+        camera properties are fetched concurrently. Must be called
+        from IOLoop thread."""
+        if self.state_cache:
+            if self.state_cache.is_stale():
+                yield self.state_cache.reload_async()
+            raise gen.Return(self.state_cache.get())
+
+        try:
+            if not self.cm:
+                self._connect()
+
+            devices = yield call_async(self.cm.listCameras)
+            _log.debug('devices: %s', devices)
+            all_props = yield [
+                call_async(self.access.get_iface(devpath, self.CM_DEVICE_IFACE).GetAll,
+                           self.CM_DEVICE_IFACE,
+                           dbus_interface=dbus.PROPERTIES_IFACE)
+                for devpath in devices]
+        except dbus.exceptions.DBusException, error:
+            _log.error('camera controller service unavaialble, error: %s', error)
+            raise CameraManagerError('Camera Controller service unavailable')
+
+        camera_data = [dict(name=props['Id'], value=props['State'])
+                       for props in all_props]
+        raise gen.Return(camera_data)
+
+
+class CameraStateCache(object):
+    """Current state of cameras kept in memory. The cache follows
+    property changes of cameras and is polled for cameras being added
+    or removed, no more often than once every POLL_INTERVAL and only
+    if camera details were requested since the last refresh. Polling is
+    done from GLib main loop thread.
+
+    State older than POLL_INTERVAL (ex. first request after a period
+    of no requests) is stale, CameraManager reloads it before serving
+    camera details."""
+
+    POLL_INTERVAL = 5.0
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.lock = threading.Lock()
+        # serializes reloads
+        self.reload_lock = threading.Lock()
+        # reload in a worker thread in flight, a future
+        self.reload_pending = None
+        # camera path -> dict(id, state, changed)
+        self.cameras = {}
+        # camera paths in order reported by controller
+        self.order = []
+        # error of last reload, None if state is current
+        self.error = 'camera state not loaded yet'
+        # time of last reload, property changes do not count as
+        # cameras may have been added or removed in the meantime
+        self.updated = 0
+        # set when details were requested since last update
+        self.requested = False
+
+    def start(self):
+        """Subscribe to controller signals, schedule initial load and
+        start poll timer"""
+        bus = self.manager.bus
+        bus.add_signal_receiver(self._on_properties_changed,
+                                signal_name='PropertiesChanged',
+                                dbus_interface=dbus.PROPERTIES_IFACE,
+                                bus_name=CameraManager.CM_SERVICE_NAME,
+                                arg0=CameraManager.CM_DEVICE_IFACE,
+                                path_keyword='path')
+        mainloop.call_soon(self.reload)
+        self._schedule_poll()
+
+    def invalidate(self):
+        """Reload camera state from GLib main loop thread"""
+        mainloop.call_soon(self.reload)
+
+    def reload(self):
+        """Load state of all cameras"""
+        with self.reload_lock:
+            self._reload()
+
+    def reload_async(self):
+        """Reload state in a worker thread, returns a future shared with
+        other callers until the reload completes. Must be called from
+        IOLoop thread."""
+        if self.reload_pending is None:
+            def _done(future):
+                self.reload_pending = None
+
+            self.reload_pending = run_blocking(self.reload)
+            IOLoop.current().add_future(self.reload_pending, _done)
+        return self.reload_pending
+
+    def is_stale(self):
+        """Return True if state was not updated within POLL_INTERVAL or the
+        last reload failed"""
+        with self.lock:
+            return self.error is not None or \
+                time.time() - self.updated >= self.POLL_INTERVAL
+
+    def _reload(self):
+        try:
+            cameras = self.manager.list_cameras()
+        except dbus.exceptions.DBusException, error:
+            _log.error('failed to load camera state: %s', error)
+            with self.lock:
+                self.error = str(error)
+                self.updated = time.time()
+            return
+
+        now = time.time()
+        with self.lock:
+            current = self.cameras
+            self.cameras = {}
+            for path, camid, state in cameras:
+                self._set(path, camid, state, now, current.get(path))
+            self.order = [path for path, _, _ in cameras]
+            self.error = None
+            self.updated = now
+            self.requested = False
+
+    def _set(self, path, camid, state, now, previous=None):
+        changed = now
+        if previous and (previous['id'], previous['state']) == (camid, state):
+            changed = previous['changed']
+        self.cameras[path] = dict(id=camid, state=state, changed=changed)
+
+    def _schedule_poll(self):
+        mainloop.call_later(int(self.POLL_INTERVAL * 1000), self._poll)
+
+    def _poll(self):
+        try:
+            with self.lock:
+                due = self.error is not None or \
+                    (self.requested and
+                     time.time() - self.updated >= self.POLL_INTERVAL)
+            if due:
+                _log.debug('polling camera state')
+                self.reload()
+        finally:
+            self._schedule_poll()
+
+    def get(self):
+        """Get a list of camera details, dict(name, value) each, in the
+        same format as CameraManager.get_details(). Raises
+        CameraManagerError if state is not available."""
+        with self.lock:
+            self.requested = True
+            if self.error is not None:
+                raise CameraManagerError('Camera Controller service unavailable')
+            return [dict(name=self.cameras[path]['id'],
+                         value=self.cameras[path]['state'])
+                    for path in self.order]
+
+    def get_changed(self):
+        """Get a dict of camera ID -> time of last state change"""
+        with self.lock:
+            return dict((cam['id'], cam['changed'])
+                        for cam in self.cameras.values())
+
+    def _on_properties_changed(self, iface, changed, invalidated, path=None):
+        with self.lock:
+            cam = self.cameras.get(path)
+            if cam is None:
+                return
+            camid = changed.get('Id', cam['id'])
+            state = changed.get('State', cam['state'])
+            self._set(path, camid, state, time.time(), cam)
+
+
+def create_camera_manager():
+    """Get a new instance of CameraManager together with its state
+    cache"""
+    mainloop.start()
+    manager = CameraManager()
+    cache = CameraStateCache(manager)
+    cache.start()
+    manager.state_cache = cache
+    return manager
+
+
 def get_camera_manager():
-    """Get an instance of NetworkManagerProvider"""
-    glib.threads_init()
-    dbus.mainloop.glib.threads_init()
-    DBusGMainLoop(set_as_default=True)
-    return CameraManager()
+    """Get process wide instance of CameraManager"""
+    from ros3dui.system.registry import registry
+    return registry.get_camera_manager()
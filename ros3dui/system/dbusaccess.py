@@ -0,0 +1,172 @@
+#
+# Copyright (c) 2015 Open-RnD Sp. z o.o.
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Shared access to D-Bus services. Object proxies are memoized and
+properties of an object are fetched with a single GetAll call. Within
+a snapshot, properties of each object are fetched at most once, either
+individually or all at once with ObjectManager.GetManagedObjects when
+the service supports it."""
+
+from __future__ import absolute_import
+
+from ros3dui.system.trace import TracedInterface
+import dbus
+import logging
+import threading
+from contextlib import contextmanager
+
+_log = logging.getLogger(__name__)
+
+OBJECT_MANAGER_IFACE = 'org.freedesktop.DBus.ObjectManager'
+
+
+class PropertiesWrapper(object):
+    """Attribute style access to properties of interface `iface` of a bus
+    object, ex. `props.DeviceType`. Properties are loaded by
+    `loader` on first access."""
+
+    def __init__(self, path, iface, loader):
+        self._path = path
+        self._iface = iface
+        self._loader = loader
+        self._props = None
+
+    def __getattr__(self, key):
+        if key.startswith('_'):
+            raise AttributeError(key)
+
+        _log.debug('get property %s', key)
+        if self._props is None:
+            self._props = self._loader(self._path, self._iface)
+        try:
+            return self._props[key]
+        except KeyError:
+            raise AttributeError('%s has no property %s' % (self._iface, key))
+
+
+class PropertiesSnapshot(object):
+    """Properties of service objects as seen at the time of taking the
+    snapshot. Properties of an interface are fetched once."""
+
+    def __init__(self, access, objects=None):
+        self.access = access
+        # (path, interface) -> properties dict
+        self.properties = {}
+        if objects:
+            for path, ifaces in objects.items():
+                for iface, props in ifaces.items():
+                    self.properties[(path, iface)] = props
+
+    def get(self, path, iface):
+        key = (path, iface)
+        if key not in self.properties:
+            self.properties[key] = self.access.fetch_properties(path, iface)
+        return self.properties[key]
+
+
+class BusAccess(object):
+    """Access to objects of service `service_name` on bus `bus`"""
+
+    def __init__(self, bus, service_name):
+        self.bus = bus
+        self.service_name = service_name
+        # (path, iface) -> interface proxy
+        self.proxies = {}
+        # ObjectManager support, None if not known yet
+        self.has_object_manager = None
+        self._local = threading.local()
+
+    def reset(self):
+        """Drop all proxies, ex. after service restart"""
+        _log.debug('dropping proxies to %s', self.service_name)
+        self.proxies = {}
+        self.has_object_manager = None
+
+    def get_iface(self, path, iface):
+        """Get proxy to interface `iface` of object at `path`"""
+        key = (path, iface)
+        proxy = self.proxies.get(key)
+        if proxy is None:
+            busobj = self.bus.get_object(self.service_name, path)
+            proxy = TracedInterface(dbus.Interface(busobj, iface))
+            self.proxies[key] = proxy
+        return proxy
+
+    def fetch_properties(self, path, iface):
+        """Fetch all properties of interface `iface` of object at `path`"""
+        _log.debug('get all properties of %s @ %s', iface, path)
+        busobj = self.get_iface(path, iface)
+        return busobj.GetAll(iface, dbus_interface=dbus.PROPERTIES_IFACE)
+
+    def get_properties(self, path, iface):
+        """Get properties of interface `iface` of object at `path`. Within a
+        snapshot properties are fetched at most once."""
+        snapshot = getattr(self._local, 'snapshot', None)
+        if snapshot is not None:
+            return snapshot.get(path, iface)
+        return self.fetch_properties(path, iface)
+
+    def get_properties_wrapper(self, path, iface):
+        """Get PropertiesWrapper for interface `iface` of object at `path`"""
+        return PropertiesWrapper(path, iface, self.get_properties)
+
+    def get_managed_objects(self, root):
+        """Get all objects under `root` with their properties using
+        ObjectManager. Returns None if the service does not support it."""
+        if self.has_object_manager is False:
+            return None
+
+        manager = self.get_iface(root, OBJECT_MANAGER_IFACE)
+        try:
+            objects = manager.GetManagedObjects()
+        except dbus.exceptions.DBusException as err:
+            if err.get_dbus_name() not in ['org.freedesktop.DBus.Error.UnknownMethod',
+                                           'org.freedesktop.DBus.Error.UnknownInterface',
+                                           'org.freedesktop.DBus.Error.UnknownObject']:
+                raise
+            _log.debug('%s does not support ObjectManager', self.service_name)
+            self.has_object_manager = False
+            return None
+
+        self.has_object_manager = True
+        return objects
+
+    @contextmanager
+    def snapshot(self, managed_root=None):
+        """Properties snapshot context for calling thread. If
+        `managed_root` is set and the service supports it, properties
+        of all objects are fetched at once."""
+        previous = getattr(self._local, 'snapshot', None)
+        if previous is not None:
+            # already within a snapshot
+            yield previous
+            return
+
+        objects = None
+        if managed_root:
+            objects = self.get_managed_objects(managed_root)
+
+        self._local.snapshot = PropertiesSnapshot(self, objects)
+        try:
+            yield self._local.snapshot
+        finally:
+            self._local.snapshot = previous
@@ -0,0 +1,93 @@
+#
+# Copyright (c) 2015 Open-RnD Sp. z o.o.
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""GLib main loop running in a background thread. D-Bus signal
+handlers registered with a bus using the GLib main loop integration
+are dispatched from this thread."""
+
+from __future__ import absolute_import
+
+import dbus
+import glib
+from dbus.mainloop.glib import DBusGMainLoop
+import logging
+import threading
+
+_log = logging.getLogger(__name__)
+
+_loop = None
+_loop_lock = threading.Lock()
+_dbus_initialized = False
+
+
+def init_dbus():
+    """Set up threading support and make GLib main loop the default for
+    D-Bus connections. Only the first call has any effect."""
+    global _dbus_initialized
+
+    with _loop_lock:
+        if _dbus_initialized:
+            return
+        glib.threads_init()
+        dbus.mainloop.glib.threads_init()
+        DBusGMainLoop(set_as_default=True)
+        _dbus_initialized = True
+
+
+def _run(loop):
+    _log.debug('GLib main loop started')
+    loop.run()
+    _log.debug('GLib main loop finished')
+
+
+def start():
+    """Start GLib main loop thread, unless it is running already"""
+    global _loop
+
+    init_dbus()
+    with _loop_lock:
+        if _loop is not None:
+            return
+
+        _loop = glib.MainLoop()
+        thread = threading.Thread(target=_run, args=(_loop,),
+                                  name='glib-mainloop')
+        thread.daemon = True
+        thread.start()
+
+
+def call_soon(callback, *args):
+    """Call `callback` from GLib main loop thread"""
+    def _idle():
+        callback(*args)
+        # do not repeat
+        return False
+    glib.idle_add(_idle)
+
+
+def call_later(delay_ms, callback, *args):
+    """Call `callback` from GLib main loop thread after `delay_ms`
+    milliseconds"""
+    def _timeout():
+        callback(*args)
+        return False
+    return glib.timeout_add(delay_ms, _timeout)
@@ -29,8 +29,35 @@ _log = logging.getLogger(__name__)
 PROVIDER_CONNMAN = 1
 PROVIDER_NETWORKMANAGER = 2
 
-def network_provider(provider_type=PROVIDER_NETWORKMANAGER):
-    # quick dbus init
+# list_interfaces() detail levels, runtime status only or status with
+# stored configuration, including secrets
+DETAIL_STATUS = 1
+DETAIL_CONFIG = 2
+
+
+class NetworkConfigError(Exception):
+    """Network configuration was saved, but could not be applied"""
+    pass
+
+
+PROVIDER_SERVICE_NAMES = {
+    PROVIDER_CONNMAN: 'net.connman',
+    PROVIDER_NETWORKMANAGER: 'org.freedesktop.NetworkManager',
+}
+
+
+def detect_provider_type(bus):
+    """Detect which network management service is running, defaults to
+    NetworkManager if none is"""
+    for provider_type in [PROVIDER_NETWORKMANAGER, PROVIDER_CONNMAN]:
+        if bus.name_has_owner(PROVIDER_SERVICE_NAMES[provider_type]):
+            return provider_type
+    _log.warning('no network management service running')
+    return PROVIDER_NETWORKMANAGER
+
+
+def create_network_provider(provider_type):
+    """Create a new network provider of type `provider_type`"""
     provider = None
     if provider_type == PROVIDER_CONNMAN:
         _log.debug('using connman provider')
@@ -45,6 +72,15 @@ def network_provider(provider_type=PROVIDER_NETWORKMANAGER):
 
     return provider
 
+
+def network_provider(provider_type=None):
+    """Get process wide network provider. Provider type is detected
+    when the provider is first requested, unless `provider_type` is
+    given."""
+    from ros3dui.system.registry import registry
+    return registry.get_network_provider(provider_type)
+
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
 
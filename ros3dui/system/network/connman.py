@@ -22,9 +22,11 @@
 # SOFTWARE.
 
 import dbus
-import glib
-from dbus.mainloop.glib import DBusGMainLoop
+from ros3dui.system import mainloop
+from ros3dui.system.network import DETAIL_CONFIG
+from ros3dui.system.trace import TracedInterface
 import logging
+import threading
 
 
 _log = logging.getLogger(__name__)
@@ -37,9 +39,11 @@ def _make_variant(string):
 #
 
 import dbus
-import glib
-from dbus.mainloop.glib import DBusGMainLoop
+from ros3dui.system import mainloop
+from ros3dui.system.network import DETAIL_CONFIG
+from ros3dui.system.trace import TracedInterface
 import logging
+import threading
 
 
 _log = logging.getLogger(__name__)
@@ -84,15 +88,33 @@ class ConnmanProvider(object):
     CONNMAN_MANAGER_IFACE = 'net.connman.Manager'
     CONNMAN_SERVICE_IFACE = 'net.connman.Service'
 
-    def __init__(self):
+    def __init__(self, service_cache=None):
         self.bus = dbus.SystemBus()
-        cmobj = self.bus.get_object(self.CONNMAN_SERVICE_NAME, '/')
-        self.cm = dbus.Interface(cmobj, self.CONNMAN_MANAGER_IFACE)
+        self._connect()
+        # ServiceCache, if set, services are looked up in the cache
+        self.service_cache = service_cache
 
-    def list_interfaces(self):
+    def _connect(self):
+        cmobj = self.bus.get_object(self.CONNMAN_SERVICE_NAME, '/')
+        self.cm = TracedInterface(dbus.Interface(cmobj, self.CONNMAN_MANAGER_IFACE))
+
+    def reconnect(self):
+        """Reconnect to connman after the service was restarted"""
+        _log.info('reconnecting to connman')
+        self._connect()
+        if self.service_cache:
+            self.service_cache.reload()
+
+    def list_interfaces(self, detail=DETAIL_CONFIG):
+        """List network interfaces, see
+        NetworkManagerProvider.list_interfaces() for `detail` levels"""
         # Connman service does not map directly to interface. A
         # visible AP can also be considered a service
-        services = self.cm.GetServices()
+        if self.service_cache:
+            # configured and connected services only
+            services = self.service_cache.get_services()
+        else:
+            services = self.cm.GetServices()
         # _log.debug('services: %s', services)
 
         # dictionary, with interface type as key, keys are:
@@ -148,7 +170,8 @@ class ConnmanProvider(object):
             if iface['online'] == True:
                 iface['ipv4'] = _extract_ip_data(props, 'IPv4')
 
-            iface['ipv4conf'] = _extract_ip_data(props, 'IPv4.Configuration')
+            if detail == DETAIL_CONFIG:
+                iface['ipv4conf'] = _extract_ip_data(props, 'IPv4.Configuration')
 
             if service_type not in interface_data:
                 interface_data[service_type] = []
@@ -161,7 +184,10 @@ class ConnmanProvider(object):
         """Find a service for which the predicate returns True. Returns path
         to service or None.
         """
-        services = self.cm.GetServices()
+        if self.service_cache:
+            services = self.service_cache.get_services(all_services=True)
+        else:
+            services = self.cm.GetServices()
 
         for service in services:
             path, props = service
@@ -176,6 +202,9 @@ class ConnmanProvider(object):
         path to service or None"""
         _log.debug('find service of type: %s', service_type)
 
+        if self.service_cache:
+            return self.service_cache.find_by_type(service_type)
+
         def _match_type(props):
             _log.debug('check service of type %s', props['Type'])
             if props['Type'].lower() == service_type.lower():
@@ -191,6 +220,9 @@ class ConnmanProvider(object):
         path to service or None"""
         _log.debug('find service of name: \'%s\'', service_name)
 
+        if self.service_cache:
+            return self.service_cache.find_by_name(service_name)
+
         def _match_name(props):
             _log.debug('check service of name %s', props['Name'])
             if props['Name'] == service_name:
@@ -219,7 +251,7 @@ class ConnmanProvider(object):
     def set_service_config(self, path, config):
         _log.debug('set config for service %s to: %s', path, config)
         servobj = self.bus.get_object(self.CONNMAN_SERVICE_NAME, path)
-        service = dbus.Interface(servobj, self.CONNMAN_SERVICE_IFACE)
+        service = TracedInterface(dbus.Interface(servobj, self.CONNMAN_SERVICE_IFACE))
         #props = dbus.Interface(servobj, 'org.freedesktop.DBus.Properties')
 
         _log.debug('service properties: %s', service.GetProperties())
@@ -245,12 +277,130 @@ class ConnmanProvider(object):
             service.SetProperty('Passphrase', _make_variant(config['password']))
 
 
-def get_connman_provider():
-    """Get an instance of ConnmanProvider"""
-    glib.threads_init()
-    dbus.mainloop.glib.threads_init()
+class ServiceCache(object):
+    """Connman services with their properties, kept current by Manager
+    ServicesChanged and Service PropertyChanged signals. Services are
+    indexed by type and name. By default only configured (favorite) or
+    connected services are exposed, a list of all services includes
+    every visible access point."""
+
+    CONNECTED_STATES = ['ready', 'online']
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.lock = threading.Lock()
+        # service path -> properties
+        self.services = {}
+        # service paths in order reported by connman
+        self.order = []
+        # lowercase type -> set of paths
+        self.by_type = {}
+        # name -> set of paths
+        self.by_name = {}
+
+    def start(self):
+        """Subscribe to connman signals and load services"""
+        bus = self.provider.bus
+        bus.add_signal_receiver(self._on_services_changed,
+                                signal_name='ServicesChanged',
+                                dbus_interface=ConnmanProvider.CONNMAN_MANAGER_IFACE,
+                                bus_name=ConnmanProvider.CONNMAN_SERVICE_NAME)
+        bus.add_signal_receiver(self._on_property_changed,
+                                signal_name='PropertyChanged',
+                                dbus_interface=ConnmanProvider.CONNMAN_SERVICE_IFACE,
+                                bus_name=ConnmanProvider.CONNMAN_SERVICE_NAME,
+                                path_keyword='path')
+        self.reload()
+
+    def reload(self):
+        """Load all services from scratch"""
+        services = self.provider.cm.GetServices()
+        _log.debug('loaded %d services', len(services))
+        with self.lock:
+            self.services = {}
+            self.by_type = {}
+            self.by_name = {}
+            self.order = []
+            for path, props in services:
+                self._set(path, dict(props))
+                self.order.append(path)
+
+    def _unindex(self, path):
+        props = self.services.get(path)
+        if not props:
+            return
+        self.by_type.get(str(props.get('Type', '')).lower(), set()).discard(path)
+        self.by_name.get(props.get('Name'), set()).discard(path)
+
+    def _set(self, path, props):
+        self._unindex(path)
+        self.services[path] = props
+        self.by_type.setdefault(str(props.get('Type', '')).lower(), set()).add(path)
+        self.by_name.setdefault(props.get('Name'), set()).add(path)
+
+    def _is_relevant(self, props):
+        return bool(props.get('Favorite', False)) or \
+            props.get('State') in self.CONNECTED_STATES
+
+    def get_services(self, all_services=False):
+        """Get a list of (path, properties) tuples of configured or connected
+        services, or all services if `all_services` is set"""
+        with self.lock:
+            return [(path, self.services[path]) for path in self.order
+                    if all_services or self._is_relevant(self.services[path])]
+
+    def _find(self, paths):
+        # follow connman ordering, preferred services come first
+        for path in self.order:
+            if path in paths:
+                _log.debug('matching service: %s', path)
+                return path
+        _log.info('matching service not found')
+        return None
+
+    def find_by_type(self, service_type):
+        """Find service of type `service_type`, returns path or None"""
+        with self.lock:
+            return self._find(self.by_type.get(service_type.lower(), set()))
+
+    def find_by_name(self, name):
+        """Find service named `name`, returns path or None"""
+        with self.lock:
+            return self._find(self.by_name.get(name, set()))
+
+    def _on_services_changed(self, changed, removed):
+        with self.lock:
+            for path in removed:
+                _log.debug('service removed: %s', path)
+                self._unindex(path)
+                self.services.pop(path, None)
+
+            for path, props in changed:
+                # only new services come with all properties, updates
+                # arrive as PropertyChanged signals
+                current = dict(self.services.get(path, {}))
+                current.update(props)
+                self._set(path, current)
+
+            self.order = [path for path, _ in changed]
+
+    def _on_property_changed(self, name, value, path=None):
+        with self.lock:
+            if path not in self.services:
+                return
+            props = dict(self.services[path])
+            props[name] = value
+            self._set(path, props)
 
-    DBusGMainLoop(set_as_default=True)
 
-    return ConnmanProvider()
+def get_connman_provider():
+    """Get a new instance of ConnmanProvider together with its service
+    cache"""
+    mainloop.start()
+
+    provider = ConnmanProvider()
+    cache = ServiceCache(provider)
+    cache.start()
+    provider.service_cache = cache
+    return provider
 
@@ -24,9 +24,12 @@
 from __future__ import absolute_import
 
 import dbus
-import glib
-from dbus.mainloop.glib import DBusGMainLoop
+from ros3dui.system import mainloop
+from ros3dui.system.network import DETAIL_CONFIG, NetworkConfigError
+from ros3dui.system.dbusaccess import BusAccess
+import copy
 import logging
+import threading
 from uuid import uuid4
 
 
@@ -102,17 +105,17 @@ def _ip_to_num(ip):
     _log.debug('converted IP address %s: %d', ip, num)
     return num
 
-class PropertiesWrapper(object):
-    def __init__(self, busobj):
-        _log.debug('properties wrapper for %s @ %s',
-                   busobj.dbus_interface, busobj.object_path)
-        self.busobj = busobj
+def _group_interfaces(ifaces):
+    """Group interface data by interface type, skipping None entries"""
+    interface_data = {}
+    for iface in ifaces:
+        if iface:
+            iftype = iface['type']
+            if iftype not in interface_data:
+                interface_data[iftype] = []
+            interface_data[iftype].append(iface)
+    return interface_data
 
-    def __getattr__(self, key):
-        _log.debug('get property %s', key)
-        return self.busobj.Get(self.busobj.dbus_interface,
-                               key,
-                               dbus_interface=dbus.PROPERTIES_IFACE)
 
 NM_DEVICE_TYPE_ETHERNET = 1
 NM_DEVICE_TYPE_WIFI = 2
@@ -136,6 +139,7 @@ class NetworkManagerProvider(object):
 
     NM_SERVICE_NAME = 'org.freedesktop.NetworkManager'
     NM_SERVICE_PATH = '/org/freedesktop/NetworkManager'
+    NM_OBJECT_MANAGER_PATH = '/org/freedesktop'
     NM_SETTINGS_PATH = '/org/freedesktop/NetworkManager/Settings'
     NM_MANAGER_IFACE = 'org.freedesktop.NetworkManager'
     NM_SETTINGS_IFACE = 'org.freedesktop.NetworkManager.Settings'
@@ -145,21 +149,55 @@ class NetworkManagerProvider(object):
     NM_DEVICE_WIRELESS_IFACE = 'org.freedesktop.NetworkManager.Device.Wireless'
     NM_IP4CONFIG_IFACE = "org.freedesktop.NetworkManager.IP4Config"
     NM_ACCESS_POINT_IFACE = "org.freedesktop.NetworkManager.AccessPoint"
-
-    def __init__(self):
+    NM_ACTIVE_CONNECTION_IFACE = 'org.freedesktop.NetworkManager.Connection.Active'
+
+    # device type matching connection type
+    CONNECTION_DEVICE_TYPES = {
+        NM_CONNECTION_TYPE_ETH: NM_DEVICE_TYPE_ETHERNET,
+        NM_CONNECTION_TYPE_WIFI: NM_DEVICE_TYPE_WIFI,
+    }
+
+    # values of settings set by us that NetworkManager leaves out of
+    # GetSettings() output when at default, (section, key) -> value
+    SETTING_DEFAULTS = {
+        ('connection', 'autoconnect'): True,
+    }
+    # deprecated, NetworkManager may leave it out, presence of security
+    # settings is compared instead
+    IGNORED_SETTINGS = frozenset([
+        (NM_CONNECTION_TYPE_WIFI, 'security'),
+    ])
+
+    def __init__(self, state_cache=None, connection_index=None):
         self.bus = dbus.SystemBus()
-        nmobj = self.bus.get_object(self.NM_SERVICE_NAME,
-                                    self.NM_SERVICE_PATH)
-        self.nm = dbus.Interface(nmobj, self.NM_MANAGER_IFACE)
+        self.access = BusAccess(self.bus, self.NM_SERVICE_NAME)
+        self.nm = self.access.get_iface(self.NM_SERVICE_PATH,
+                                        self.NM_MANAGER_IFACE)
+        # NetworkStateCache, if set, list_interfaces() is served from
+        # the cache
+        self.state_cache = state_cache
+        # ConnectionIndex, if set, saved connections are looked up in
+        # the index
+        self.connection_index = connection_index
+
+    def reconnect(self):
+        """Reconnect to NetworkManager after the service was restarted,
+        rebuilds connection index and state cache"""
+        _log.info('reconnecting to NetworkManager')
+        self.access.reset()
+        self.nm = self.access.get_iface(self.NM_SERVICE_PATH,
+                                        self.NM_MANAGER_IFACE)
+        if self.connection_index:
+            self.connection_index.reload()
+        if self.state_cache:
+            self.state_cache.reload()
 
     def _get_bus_iface(self, devpath, iface):
         """Get proxy to interface and proxy for accessing interface properties
         for bus object at path `devpath` and interface `iface`
         """
-        devobj = self.bus.get_object(self.NM_SERVICE_NAME,
-                                    devpath)
-        dev = dbus.Interface(devobj, iface)
-        return dev, PropertiesWrapper(dev)
+        dev = self.access.get_iface(devpath, iface)
+        return dev, self.access.get_properties_wrapper(devpath, iface)
 
     def _get_device(self, devpath):
         """Proxy to device interface and it's properties"""
@@ -226,31 +264,43 @@ class NetworkManagerProvider(object):
         return wifi_info
 
     def _get_settings_of_type(self, setting_type):
-        """Find settings of given type and return interface proxy"""
+        """Find settings of given type and return interface proxy and
+        settings data, or (None, None) if no settings were found"""
         settings = self._find_settings_of_type(setting_type)
 
-        if len(settings) == 0:
-            _log.warning('no settings found')
-            return
-
-        conf = settings[0]
-        _log.debug('settings: %s', conf)
-
-        siface, props = self._get_bus_iface(conf,
-                                            self.NM_CONNECTION_IFACE)
-        return siface
+        for conf in settings:
+            _log.debug('settings: %s', conf)
+
+            siface, props = self._get_bus_iface(conf,
+                                                self.NM_CONNECTION_IFACE)
+            data = None
+            if self.connection_index:
+                data = self.connection_index.get_settings(conf)
+            if data is None:
+                # not indexed (anymore), possibly removed in the
+                # meantime
+                try:
+                    data = siface.GetSettings()
+                except dbus.exceptions.DBusException:
+                    _log.warning('failed to get settings of %s', conf)
+                    if self.connection_index:
+                        self.connection_index.remove(conf)
+                    continue
+            return siface, data
+
+        _log.warning('no settings found')
+        return None, None
 
 
     def _get_ipv4_conf(self, devpath, devtype):
         """Dump IPv4 configuration. Returns a dict with the same keys as
         :_get_ipv4_data:"""
 
-        iface = self._get_settings_of_type(devtype)
+        iface, data = self._get_settings_of_type(devtype)
         if not iface:
             _log.warning('no settings for device of type %s', devtype)
             return {}
 
-        data = iface.GetSettings()
         ipv4conf = {}
 
         if data.has_key('ipv4') == False or data['ipv4']['method'] == 'auto':
@@ -274,12 +324,11 @@ class NetworkManagerProvider(object):
 
         or None if no wifi confguration is defined"""
 
-        iface = self._get_settings_of_type(NM_CONNECTION_TYPE_WIFI)
+        iface, data = self._get_settings_of_type(NM_CONNECTION_TYPE_WIFI)
         if not iface:
             _log.warning('no wireless settings')
             return {}
 
-        data = iface.GetSettings()
         wificonf = {}
 
         _log.debug('got wifi settings: %s', data)
@@ -310,13 +359,10 @@ class NetworkManagerProvider(object):
             iface['type'] = 'wired'
             wired, wprops = self._get_wired_device(dev.object_path)
             iface['mac'] = str(wprops.HwAddress)
-            conn_type = NM_CONNECTION_TYPE_ETH
         elif devtype == NM_DEVICE_TYPE_WIFI:
             iface['type'] = 'wireless'
             wireless, wprops = self._get_wireless_device(dev.object_path)
             iface['mac'] = str(wprops.HwAddress)
-            iface['wificonf'] = self._get_wireless_conf(dev.object_path)
-            conn_type = NM_CONNECTION_TYPE_WIFI
         else:
             # skip all other interfaces
             return None
@@ -352,14 +398,57 @@ class NetworkManagerProvider(object):
                 method = 'static'
             iface['ipv4']['method'] = method
 
-        iface['ipv4conf'] = self._get_ipv4_conf(dev.object_path,
-                                                conn_type)
+        return iface
 
+    def _add_config(self, interface_data):
+        """Add stored configuration to interface data obtained with
+        DETAIL_STATUS"""
+        for iface in interface_data.get('wired', []):
+            iface['ipv4conf'] = self._get_ipv4_conf(iface['device'],
+                                                    NM_CONNECTION_TYPE_ETH)
+        for iface in interface_data.get('wireless', []):
+            iface['ipv4conf'] = self._get_ipv4_conf(iface['device'],
+                                                    NM_CONNECTION_TYPE_WIFI)
+            iface['wificonf'] = self._get_wireless_conf(iface['device'])
+
+    def _dump_device_at(self, devpath):
+        """Dump interface data of device at path `devpath`, returns None for
+        devices of unsupported types"""
+        dev, props = self._get_device(devpath)
+        _log.debug('dev: %s', props.Interface)
+        _log.debug('device type: %d', props.DeviceType)
+
+        iface = self._dump_device(dev, props)
+
+        _log.debug('interface data: %s', iface)
         return iface
 
-    def list_interfaces(self):
+    def list_devices(self):
+        """List paths of all devices"""
         devices = self.nm.GetDevices()
         _log.debug('devices: %s', devices)
+        return devices
+
+    def list_interfaces(self, detail=DETAIL_CONFIG):
+        """List network interfaces. With `detail` set to DETAIL_STATUS only
+        the runtime status of interfaces is provided. DETAIL_CONFIG adds
+        stored configuration (ipv4conf) and for wireless interfaces,
+        WiFi configuration including secrets (wificonf)."""
+        if self.state_cache:
+            interface_data = self.state_cache.get()
+        else:
+            interface_data = self._list_interfaces()
+
+        if detail == DETAIL_CONFIG:
+            self._add_config(interface_data)
+        return interface_data
+
+    def _list_interfaces(self):
+        with self.access.snapshot(self.NM_OBJECT_MANAGER_PATH):
+            return self._dump_interfaces()
+
+    def _dump_interfaces(self):
+        devices = self.list_devices()
 
         # dictionary, with interface type as key, keys are:
         # - wired
@@ -371,23 +460,8 @@ class NetworkManagerProvider(object):
         # - MAC
         # - IPv4 (dict with keys address, netmask, gateway)
 
-        interface_data = {}
-        for devpath in devices:
-            dev, props = self._get_device(devpath)
-            _log.debug('dev: %s', props.Interface)
-            _log.debug('device type: %d', props.DeviceType)
-
-            iface = self._dump_device(dev, props)
-
-            _log.debug('interface data: %s', iface)
-
-            if iface:
-                iftype = iface['type']
-                if iftype not in interface_data:
-                    interface_data[iftype] = []
-                interface_data[iftype].append(iface)
-
-        return interface_data
+        return _group_interfaces(self._dump_device_at(devpath)
+                                 for devpath in devices)
 
     def _find_settings(self, predicate):
         """Find settings for which the predicate returns True. Returns a list of paths
@@ -409,6 +483,9 @@ class NetworkManagerProvider(object):
         path to service or None"""
         _log.debug('find service of type: %s', service_type)
 
+        if self.connection_index:
+            return self.connection_index.find_of_type(service_type)
+
         def _match_type(path):
             setting, props = self._get_bus_iface(path, self.NM_CONNECTION_IFACE)
             data = setting.GetSettings()
@@ -425,6 +502,8 @@ class NetworkManagerProvider(object):
             conn, props = self._get_bus_iface(srvpath,
                                               self.NM_CONNECTION_IFACE)
             conn.Delete()
+            if self.connection_index:
+                self.connection_index.remove(srvpath)
 
 
     def set_config(self, config):
@@ -445,30 +524,84 @@ class NetworkManagerProvider(object):
              }
         }
         }
+
+        Connections are updated in place and only if the requested
+        configuration differs from the current one. Changed settings are
+        applied to the device right away, raises NetworkConfigError if
+        that fails.
         """
         _log.debug('set configuration: %s', config)
 
-        for key, conf in config.items():
-            if key == 'wired':
-                srvtype = NM_CONNECTION_TYPE_ETH
-            elif key == 'wireless':
-                srvtype = NM_CONNECTION_TYPE_WIFI
-            paths = self._find_settings_of_type(srvtype)
-
-            _log.debug('service path: %s', paths)
-            if paths:
-                # first remove all settings
-                self._remove_settings(paths)
-
-            # add new setting
-            self._set_service_config(srvtype, conf[0])
-
-    def _set_service_config(self, srvtype, config):
-        _log.debug('set config for service %s to: %s', srvtype, config)
-
-        settings, props = self._get_bus_iface(self.NM_SETTINGS_PATH,
-                                              self.NM_SETTINGS_IFACE)
+        try:
+            for key, conf in config.items():
+                if key == 'wired':
+                    srvtype = NM_CONNECTION_TYPE_ETH
+                elif key == 'wireless':
+                    srvtype = NM_CONNECTION_TYPE_WIFI
+                paths = self._find_settings_of_type(srvtype)
+
+                _log.debug('service path: %s', paths)
+                if paths:
+                    # keep the first connection, remove the others
+                    self._remove_settings(paths[1:])
+                    path = paths[0]
+                    changed = self._update_service_config(path, srvtype,
+                                                          conf[0])
+                else:
+                    # add new setting
+                    path = self._set_service_config(srvtype, conf[0])
+                    changed = True
+
+                if changed:
+                    self._apply_connection(path, srvtype)
+        finally:
+            if self.state_cache:
+                self.state_cache.invalidate()
+
+    def _apply_connection(self, path, srvtype):
+        """Apply settings of connection at `path` to a device of matching
+        type. If the connection is active on the device, settings are
+        reapplied with Device.Reapply(), otherwise, or if reapplying is
+        not possible (ex. changed SSID or NetworkManager older than
+        1.2), the connection is activated. Raises NetworkConfigError if
+        neither worked."""
+        devtype = self.CONNECTION_DEVICE_TYPES[srvtype]
+        devices = [devpath for devpath in self.list_devices()
+                   if self._get_device(devpath)[1].DeviceType == devtype]
+        if not devices:
+            _log.warning('no device for connection %s, settings not applied',
+                         path)
+            return
 
+        # expecting only one device of given type
+        devpath = devices[0]
+        dev, props = self._get_device(devpath)
+        active = props.ActiveConnection
+        if active != '/':
+            aconn, aprops = self._get_bus_iface(active,
+                                                self.NM_ACTIVE_CONNECTION_IFACE)
+            if aprops.Connection == path:
+                try:
+                    # empty settings, the updated connection is used
+                    dev.Reapply(dbus.Dictionary({}, signature='sa{sv}'),
+                                dbus.UInt64(0), dbus.UInt32(0))
+                    _log.info('settings of %s reapplied to %s', path, devpath)
+                    return
+                except dbus.exceptions.DBusException as err:
+                    _log.warning('cannot reapply settings of %s to %s: %s',
+                                 path, devpath, err)
+
+        try:
+            active = self.nm.ActivateConnection(path, devpath, '/')
+        except dbus.exceptions.DBusException as err:
+            _log.error('failed to activate %s on %s: %s', path, devpath, err)
+            raise NetworkConfigError('failed to apply configuration: {}'.format(
+                err.get_dbus_message()))
+        _log.info('connection %s activated on %s: %s', path, devpath, active)
+
+    def _build_service_config(self, srvtype, config):
+        """Build NetworkManager connection settings for service of type
+        `srvtype` from `config`"""
         srvconf = {
             'connection': {
                 'type': srvtype,
@@ -512,18 +645,512 @@ class NetworkManagerProvider(object):
                 ]
             ]
 
+        return srvconf
+
+    def _set_service_config(self, srvtype, config):
+        _log.debug('set config for service %s to: %s', srvtype, config)
+
+        settings, props = self._get_bus_iface(self.NM_SETTINGS_PATH,
+                                              self.NM_SETTINGS_IFACE)
+
+        srvconf = self._build_service_config(srvtype, config)
+
         _log.debug('service config: %s', srvconf)
         path = settings.AddConnection(srvconf)
         _log.debug('settings added at path: %s', path)
-        return
+        if self.connection_index:
+            self.connection_index.update(path)
+        return path
+
+    def _update_service_config(self, path, srvtype, config):
+        """Update connection at `path` with `config`, only if the
+        configuration changed. Returns True if connection was updated."""
+        _log.debug('update config of %s to: %s', path, config)
+
+        conn, props = self._get_bus_iface(path, self.NM_CONNECTION_IFACE)
+        current = None
+        if self.connection_index:
+            current = self.connection_index.get_settings(path)
+        if current is None:
+            current = conn.GetSettings()
+
+        desired = self._build_service_config(srvtype, config)
+
+        changed = False
+        # connection and device specific settings, only the keys set
+        # by us are compared, others are left intact, missing keys are
+        # at their default values
+        for section in ['connection', srvtype]:
+            for key, value in desired[section].items():
+                if key == 'uuid' or (section, key) in self.IGNORED_SETTINGS:
+                    continue
+                default = self.SETTING_DEFAULTS.get((section, key))
+                if current.get(section, {}).get(key, default) != value:
+                    _log.debug('%s.%s changed', section, key)
+                    changed = True
+
+        # IPv4 settings are replaced as a whole
+        current_ipv4 = current.get('ipv4', {})
+        if current_ipv4.get('method') != desired['ipv4']['method']:
+            changed = True
+        elif desired['ipv4']['method'] == 'manual' and \
+             current_ipv4.get('addresses') != desired['ipv4']['addresses']:
+            changed = True
+
+        # security settings, secrets are not a part of settings data
+        # and need to be fetched separately
+        if (NM_SECURITY_TYPE_WIFI in current) != (NM_SECURITY_TYPE_WIFI in desired):
+            changed = True
+        elif NM_SECURITY_TYPE_WIFI in desired:
+            current_sec = current[NM_SECURITY_TYPE_WIFI]
+            desired_sec = desired[NM_SECURITY_TYPE_WIFI]
+            if current_sec.get(NM_SECURITY_WIFI_KEY_MGMT) != desired_sec[NM_SECURITY_WIFI_KEY_MGMT]:
+                changed = True
+            else:
+                secrets = conn.GetSecrets(NM_SECURITY_TYPE_WIFI)
+                current_psk = secrets.get(NM_SECURITY_TYPE_WIFI, {}).get(NM_SECURITY_WPA_PSK)
+                if current_psk != desired_sec[NM_SECURITY_WPA_PSK]:
+                    changed = True
+
+        if not changed:
+            _log.info('configuration of %s unchanged, skipping', path)
+            return False
 
+        # merge desired settings into current ones
+        srvconf = {}
+        for section, values in current.items():
+            srvconf[section] = dict(values)
+        for section in ['connection', srvtype]:
+            srvconf.setdefault(section, {})
+            for key, value in desired[section].items():
+                if key == 'uuid':
+                    continue
+                srvconf[section][key] = value
+        srvconf['ipv4'] = desired['ipv4']
+        if NM_SECURITY_TYPE_WIFI in desired:
+            srvconf[NM_SECURITY_TYPE_WIFI] = desired[NM_SECURITY_TYPE_WIFI]
+        else:
+            srvconf.pop(NM_SECURITY_TYPE_WIFI, None)
+            srvconf.get(srvtype, {}).pop('security', None)
+
+        _log.debug('updated service config: %s', srvconf)
+        conn.Update(srvconf)
+        if self.connection_index:
+            self.connection_index.update(path)
+        return True
+
+
+def _remove_matches(matches):
+    """Remove signal receivers `matches` returned by
+    add_signal_receiver()"""
+    for match in matches:
+        try:
+            match.remove()
+        except Exception:
+            _log.exception('failed to remove signal receiver')
+
+
+class ConnectionIndex(object):
+    """Settings of saved NetworkManager connections indexed by connection
+    path, type and UUID. The index is built once and kept current by
+    Settings NewConnection/ConnectionRemoved and Connection
+    Updated/Removed signals.
+    """
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.lock = threading.Lock()
+        # connection path -> settings
+        self.settings = {}
+        # connection type -> set of paths
+        self.by_type = {}
+        # connection paths in the order of ListConnections(), followed
+        # by new connections
+        self.order = []
+        # UUID -> path
+        self.by_uuid = {}
+        # signal receivers
+        self.matches = []
+
+    def start(self):
+        """Subscribe to settings signals and build the index. Signal
+        receivers are removed if the index cannot be built, ex. when
+        NetworkManager is not running."""
+        bus = self.provider.bus
+        nmp = NetworkManagerProvider
+        self.matches = [
+            bus.add_signal_receiver(self._on_new_connection,
+                                    signal_name='NewConnection',
+                                    dbus_interface=nmp.NM_SETTINGS_IFACE,
+                                    bus_name=nmp.NM_SERVICE_NAME),
+            bus.add_signal_receiver(self._on_connection_removed,
+                                    signal_name='ConnectionRemoved',
+                                    dbus_interface=nmp.NM_SETTINGS_IFACE,
+                                    bus_name=nmp.NM_SERVICE_NAME),
+            # older NetworkManager versions signal removal on the
+            # connection object only
+            bus.add_signal_receiver(self._on_removed,
+                                    signal_name='Removed',
+                                    dbus_interface=nmp.NM_CONNECTION_IFACE,
+                                    bus_name=nmp.NM_SERVICE_NAME,
+                                    path_keyword='path'),
+            bus.add_signal_receiver(self._on_updated,
+                                    signal_name='Updated',
+                                    dbus_interface=nmp.NM_CONNECTION_IFACE,
+                                    bus_name=nmp.NM_SERVICE_NAME,
+                                    path_keyword='path'),
+        ]
+        try:
+            self.reload()
+        except Exception:
+            self.stop()
+            raise
+
+    def stop(self):
+        """Remove signal receivers"""
+        _remove_matches(self.matches)
+        self.matches = []
+
+    def reload(self):
+        """Rebuild the index from scratch"""
+        settings, _ = self.provider._get_bus_iface(
+            NetworkManagerProvider.NM_SETTINGS_PATH,
+            NetworkManagerProvider.NM_SETTINGS_IFACE)
+
+        paths = settings.ListConnections()
+        _log.debug('indexing %d connections', len(paths))
+        with self.lock:
+            self.settings = {}
+            self.by_type = {}
+            self.by_uuid = {}
+            self.order = []
+        for path in paths:
+            self.update(path)
+
+    def update(self, path):
+        """Fetch settings of connection at `path` and update the index"""
+        conn, _ = self.provider._get_bus_iface(
+            path, NetworkManagerProvider.NM_CONNECTION_IFACE)
+        try:
+            data = conn.GetSettings()
+        except dbus.exceptions.DBusException:
+            _log.exception('failed to get settings of %s', path)
+            self.remove(path)
+            return
 
-def get_networkmanager_provider():
-    """Get an instance of NetworkManagerProvider"""
-    glib.threads_init()
-    dbus.mainloop.glib.threads_init()
+        with self.lock:
+            self._remove(path)
+            self.settings[path] = data
+            conn_type = str(data['connection']['type'])
+            self.by_type.setdefault(conn_type, set()).add(path)
+            self.by_uuid[str(data['connection']['uuid'])] = path
+            if path not in self.order:
+                self.order.append(path)
+
+    def _remove(self, path):
+        data = self.settings.pop(path, None)
+        if data is None:
+            return
+        conn_type = str(data['connection']['type'])
+        self.by_type.get(conn_type, set()).discard(path)
+        self.by_uuid.pop(str(data['connection']['uuid']), None)
+
+    def remove(self, path):
+        """Drop connection at `path` from the index"""
+        with self.lock:
+            self._remove(path)
+            if path in self.order:
+                self.order.remove(path)
+
+    def find_of_type(self, conn_type):
+        """Get a list of paths of connections of type `conn_type`, in
+        the order reported by NetworkManager"""
+        with self.lock:
+            paths = self.by_type.get(conn_type, set())
+            return [path for path in self.order if path in paths]
+
+    def find_by_uuid(self, uuid):
+        """Get path of connection with given `uuid` or None"""
+        with self.lock:
+            return self.by_uuid.get(uuid)
+
+    def get_settings(self, path):
+        """Get settings of connection at `path` or None"""
+        with self.lock:
+            return self.settings.get(path)
+
+    def _on_new_connection(self, path):
+        _log.debug('new connection %s', path)
+        self.update(path)
+
+    def _on_connection_removed(self, path):
+        _log.debug('connection %s removed', path)
+        self.remove(path)
+
+    def _on_removed(self, path=None):
+        self._on_connection_removed(path)
+
+    def _on_updated(self, path=None):
+        _log.debug('connection %s updated', path)
+        self.update(path)
+
+
+class NetworkStateCache(object):
+    """In-memory copy of interface status as returned by
+    NetworkManagerProvider.list_interfaces(DETAIL_STATUS). The cache is populated
+    once and kept current by NetworkManager signals. Signals are
+    dispatched in GLib main loop thread, changes are coalesced and
+    affected devices are refreshed after `REFRESH_DELAY_MS`. Readers
+    get a copy of the most recent consistent snapshot.
+
+    Property changes are mapped to devices using object paths seen
+    during the last refresh (IPv4 and DHCP configuration, active access
+    point), changes of other objects are ignored. Signal strength of an
+    active access point is updated in place.
+    """
+
+    REFRESH_DELAY_MS = 200
+
+    # device properties the interface data is built from
+    DEVICE_PROPERTIES = set(['DeviceType', 'State', 'Interface',
+                             'HwAddress', 'Ip4Config', 'Dhcp4Config',
+                             'ActiveAccessPoint', 'Bitrate'])
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.lock = threading.Lock()
+        # serializes refreshes
+        self.refresh_lock = threading.Lock()
+        # device path -> interface data, protected by refresh_lock
+        self.devices = {}
+        # path of an object related to device -> device path, protected
+        # by lock
+        self.related = {}
+        # paths of devices needing a refresh, protected by lock
+        self.dirty = set()
+        self.refresh_all = False
+        self.refresh_pending = False
+        # grouped interface data, replaced on every refresh
+        self.snapshot = None
+        # signal receivers
+        self.matches = []
+
+    def start(self):
+        """Subscribe to NetworkManager signals and populate the cache.
+        Signal receivers are removed if populating fails."""
+        bus = self.provider.bus
+        nmp = NetworkManagerProvider
+        self.matches = [
+            bus.add_signal_receiver(self._on_device_added,
+                                    signal_name='DeviceAdded',
+                                    dbus_interface=nmp.NM_MANAGER_IFACE,
+                                    bus_name=nmp.NM_SERVICE_NAME),
+            bus.add_signal_receiver(self._on_device_removed,
+                                    signal_name='DeviceRemoved',
+                                    dbus_interface=nmp.NM_MANAGER_IFACE,
+                                    bus_name=nmp.NM_SERVICE_NAME),
+            bus.add_signal_receiver(self._on_device_changed,
+                                    signal_name='StateChanged',
+                                    dbus_interface=nmp.NM_DEVICE_IFACE,
+                                    bus_name=nmp.NM_SERVICE_NAME,
+                                    path_keyword='path'),
+            # both NM specific PropertiesChanged signals and the ones
+            # from org.freedesktop.DBus.Properties, filtered by
+            # interface in the handler
+            bus.add_signal_receiver(self._on_properties_changed,
+                                    signal_name='PropertiesChanged',
+                                    bus_name=nmp.NM_SERVICE_NAME,
+                                    path_keyword='path',
+                                    interface_keyword='interface'),
+        ]
+        try:
+            self.reload()
+        except Exception:
+            self.stop()
+            raise
+
+    def stop(self):
+        """Remove signal receivers"""
+        _remove_matches(self.matches)
+        self.matches = []
+
+    def reload(self):
+        """Reload data of all devices"""
+        with self.lock:
+            self.refresh_all = True
+            self.dirty.clear()
+        self._refresh()
+
+    def invalidate(self, devpath=None):
+        """Mark device at `devpath`, or all devices if None, as needing a
+        refresh"""
+        with self.lock:
+            if devpath:
+                self.dirty.add(devpath)
+            else:
+                self.refresh_all = True
+            if self.refresh_pending:
+                return
+            self.refresh_pending = True
+        mainloop.call_later(self.REFRESH_DELAY_MS, self._refresh)
+
+    def _refresh(self):
+        with self.refresh_lock:
+            self._do_refresh()
+
+    def _do_refresh(self):
+        with self.lock:
+            refresh_all = self.refresh_all
+            dirty = self.dirty
+            self.refresh_all = False
+            self.dirty = set()
+            self.refresh_pending = False
+
+        # fetch the whole object tree at once when refreshing all
+        # devices
+        managed_root = None
+        if refresh_all:
+            managed_root = NetworkManagerProvider.NM_OBJECT_MANAGER_PATH
+
+        try:
+            with self.provider.access.snapshot(managed_root):
+                self._refresh_devices(refresh_all, dirty)
+        except dbus.exceptions.DBusException:
+            _log.exception('failed to refresh network state')
+            with self.lock:
+                self.snapshot = None
+            return
 
-    DBusGMainLoop(set_as_default=True)
+        self._publish()
+
+    def _publish(self):
+        """Replace snapshot with current device data, must be called with
+        refresh_lock held"""
+        snapshot = _group_interfaces(self.devices[devpath]
+                                     for devpath in sorted(self.devices))
+        with self.lock:
+            self.snapshot = snapshot
+
+    def _refresh_devices(self, refresh_all, dirty):
+        if refresh_all:
+            _log.debug('refreshing all devices')
+            self.devices = dict((devpath, None)
+                                for devpath in self.provider.list_devices())
+            dirty = set(self.devices.keys())
+            with self.lock:
+                self.related = {}
+
+        for devpath in dirty:
+            if devpath not in self.devices:
+                continue
+            _log.debug('refreshing device %s', devpath)
+            try:
+                self.devices[devpath] = self.provider._dump_device_at(devpath)
+                related = self._related_paths(devpath)
+            except dbus.exceptions.DBusException:
+                _log.exception('failed to refresh device %s', devpath)
+                self.devices.pop(devpath)
+                related = set()
+
+            with self.lock:
+                for path, owner in self.related.items():
+                    if owner == devpath:
+                        del self.related[path]
+                for path in related:
+                    self.related[path] = devpath
+
+    def _related_paths(self, devpath):
+        """Get paths of objects interface data of device at `devpath` was
+        built from, properties are already in the snapshot"""
+        if self.devices.get(devpath) is None:
+            return set()
+
+        dev, props = self.provider._get_device(devpath)
+        paths = [props.Ip4Config, props.Dhcp4Config]
+        if props.DeviceType == NM_DEVICE_TYPE_WIFI:
+            wifi, wprops = self.provider._get_wireless_device(devpath)
+            paths.append(wprops.ActiveAccessPoint)
+        return set(str(path) for path in paths if path != '/')
+
+    def _update_strength(self, devpath, strength):
+        """Update signal strength of wireless device at `devpath` in
+        place"""
+        with self.refresh_lock:
+            iface = self.devices.get(devpath)
+            if not iface or 'strength' not in iface:
+                return
+            _log.debug('strength of %s: %d', devpath, strength)
+            iface['strength'] = strength
+            self._publish()
+
+    def get(self):
+        """Get a copy of current interface data"""
+        with self.lock:
+            snapshot = self.snapshot
+        if snapshot is None:
+            # not populated yet or previous refresh failed
+            _log.debug('no network state snapshot, querying devices')
+            return self.provider._list_interfaces()
+        return copy.deepcopy(snapshot)
+
+    def _on_device_added(self, devpath):
+        _log.debug('device added: %s', devpath)
+        self.invalidate()
+
+    def _on_device_removed(self, devpath):
+        _log.debug('device removed: %s', devpath)
+        self.invalidate()
+
+    def _on_device_changed(self, *args, **kwargs):
+        self.invalidate(kwargs['path'])
+
+    def _on_properties_changed(self, *args, **kwargs):
+        path = str(kwargs['path'])
+        if kwargs['interface'] == dbus.PROPERTIES_IFACE:
+            # (interface, changed, invalidated)
+            iface, changed = args[0], args[1]
+        else:
+            # NM specific signal of the interface itself, (changed)
+            iface, changed = kwargs['interface'], args[0]
+
+        nmp = NetworkManagerProvider
+        if iface in [nmp.NM_DEVICE_IFACE, nmp.NM_DEVICE_WIRED_IFACE,
+                     nmp.NM_DEVICE_WIRELESS_IFACE]:
+            # anything but properties interface data is built from, ex.
+            # list of visible access points, is of no interest
+            if self.DEVICE_PROPERTIES.intersection(changed.keys()):
+                self.invalidate(path)
+            return
 
-    return NetworkManagerProvider()
+        with self.lock:
+            devpath = self.related.get(path)
+        if not devpath:
+            # not an active access point nor a configuration of any
+            # device, ex. other access points or active connections
+            return
+
+        if iface == nmp.NM_ACCESS_POINT_IFACE and changed.keys() == ['Strength']:
+            self._update_strength(devpath, int(changed['Strength']))
+        else:
+            self.invalidate(devpath)
 
+
+def get_networkmanager_provider():
+    """Get a new instance of NetworkManagerProvider together with its
+    connection index and network state cache"""
+    mainloop.start()
+
+    provider = NetworkManagerProvider()
+    index = ConnectionIndex(provider)
+    index.start()
+    provider.connection_index = index
+
+    cache = NetworkStateCache(provider)
+    try:
+        cache.start()
+    except Exception:
+        index.stop()
+        raise
+    provider.state_cache = cache
+
+    return provider
@@ -0,0 +1,103 @@
+#
+# Copyright (c) 2015 Open-RnD Sp. z o.o.
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Process wide registry of system service backends. Backends are
+created once, on first use, and reconnected when the D-Bus service
+they talk to is restarted."""
+
+from __future__ import absolute_import
+
+import dbus
+import logging
+import threading
+
+_log = logging.getLogger(__name__)
+
+
+class ServiceRegistry(object):
+    """Holds a single network provider and a single camera manager for
+    the process lifetime. Each backend is reconnected once its D-Bus
+    service gets a new owner."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.network = None
+        self.camera = None
+        # service name -> current owner
+        self.owners = {}
+
+    def get_network_provider(self, provider_type=None):
+        """Get network provider, creating it if needed. Provider type is
+        detected if `provider_type` is None"""
+        from ros3dui.system import network
+
+        with self.lock:
+            if self.network is None:
+                from ros3dui.system.mainloop import init_dbus
+                init_dbus()
+
+                if provider_type is None:
+                    provider_type = network.detect_provider_type(dbus.SystemBus())
+                provider = network.create_network_provider(provider_type)
+                self._watch(network.PROVIDER_SERVICE_NAMES[provider_type],
+                            provider)
+                self.network = provider
+            return self.network
+
+    def get_camera_manager(self):
+        """Get camera manager, creating it if needed"""
+        from ros3dui.system.camera import create_camera_manager, CameraManager
+
+        with self.lock:
+            if self.camera is None:
+                manager = create_camera_manager()
+                self._watch(CameraManager.CM_SERVICE_NAME, manager)
+                self.camera = manager
+            return self.camera
+
+    def _watch(self, service_name, backend):
+        """Reconnect `backend` whenever `service_name` changes owner"""
+        def _owner_changed(owner):
+            self._on_owner_changed(service_name, backend, owner)
+
+        dbus.SystemBus().watch_name_owner(service_name, _owner_changed)
+
+    def _on_owner_changed(self, service_name, backend, owner):
+        previous = self.owners.get(service_name)
+        self.owners[service_name] = owner
+        _log.debug('service %s owner: %r -> %r', service_name, previous, owner)
+
+        if not owner:
+            _log.warning('service %s is gone', service_name)
+            return
+
+        if previous is None or previous == owner:
+            # initial notification or no change
+            return
+
+        try:
+            backend.reconnect()
+        except dbus.exceptions.DBusException:
+            _log.exception('failed to reconnect to %s', service_name)
+
+
+registry = ServiceRegistry()
@@ -23,64 +23,131 @@
 
 import logging
 import json
+import time
 from tornado import httpclient
+from tornado import gen
 from ros3dui.system.util import ConfigLoader
+from ros3dui.system import trace
 
 LOG = logging.getLogger(__name__)
 
-
-class DevControllerRestClient(httpclient.HTTPClient):
-    """ROS3D device controller REST client"""
+# maximum number of simultaneous connections to the controller
+MAX_CLIENTS = 4
+
+
+def configure_http_client(max_clients=MAX_CLIENTS):
+    """Configure shared asynchronous HTTP client. libcurl based client is
+    used when pycurl is available as it keeps connections to the
+    controller alive between requests, simple HTTP client is used
+    otherwise."""
+    try:
+        import pycurl
+    except ImportError:
+        LOG.debug('pycurl not available, using simple HTTP client')
+        httpclient.AsyncHTTPClient.configure(None, max_clients=max_clients)
+    else:
+        LOG.debug('using curl HTTP client')
+        httpclient.AsyncHTTPClient.configure(
+            'tornado.curl_httpclient.CurlAsyncHTTPClient',
+            max_clients=max_clients)
+
+
+class DevControllerRestClient(object):
+    """ROS3D device controller REST client. Requests are issued through
+    a shared asynchronous HTTP client, all request methods are
+    coroutines. Each method accepts an optional `timeout` (in seconds)
+    overriding the default one."""
 
     API_PREFIX = "api"
     REQUEST_SNAPSHOTS = "snapshots"
     REQUEST_SNAPSHOTS_LIST = "list"
 
-    def __init__(self):
-        super(DevControllerRestClient, self).__init__()
+    DEFAULT_TIMEOUT = 10.0
+    CONNECT_TIMEOUT = 5.0
 
-        config = ConfigLoader()
-        self.rest_url = config.get_rest_url()
-        LOG.debug('rest client created')
+    def __init__(self, rest_url=None, timeout=DEFAULT_TIMEOUT):
+        if not rest_url:
+            config = ConfigLoader.snapshot()
+            rest_url = config.get_rest_url()
+        self.rest_url = rest_url
+        self.timeout = timeout
+        self.client = httpclient.AsyncHTTPClient()
+        LOG.debug('rest client created for %s', self.rest_url)
 
     def _build_request_url(self, request_paths):
         """Builds request url"""
         paths = [self.rest_url, self.API_PREFIX] + request_paths
         return '/'.join(paths)
 
-    def _process_request(self, request, method='GET'):
-        """Sends request and handle the response"""
-        response = self.fetch(request, method=method)
+    @gen.coroutine
+    def _process_request(self, request, method='GET', timeout=None,
+                         endpoint=None):
+        """Sends request and handle the response. Request is traced as
+        `endpoint`"""
+        if timeout is None:
+            timeout = self.timeout
+
+        endpoint = '{} {}'.format(method, endpoint or request)
+        start = time.time()
+        try:
+            response = yield self.client.fetch(
+                request, method=method,
+                request_timeout=timeout,
+                connect_timeout=min(timeout, self.CONNECT_TIMEOUT))
+        except Exception:
+            trace.record(trace.REST, endpoint, time.time() - start, True)
+            raise
+        trace.record(trace.REST, endpoint, time.time() - start,
+                     response.code != 200)
 
         if response.code != 200:
             LOG.error("Response status %s for request %s", response.code,
                       request)
-            return None
+            raise gen.Return(None)
 
-        return response.body
+        raise gen.Return(response.body)
 
-    def get_snapshots_list(self):
+    @gen.coroutine
+    def get_snapshots_list(self, timeout=None):
         """Returns list of snapshots"""
         request = self._build_request_url(
             [self.REQUEST_SNAPSHOTS, self.REQUEST_SNAPSHOTS_LIST])
 
-        return json.loads(self._process_request(request))
+        body = yield self._process_request(request, timeout=timeout,
+                                           endpoint='snapshots/list')
+        raise gen.Return(json.loads(body))
 
-    def get_snapshot(self, snapshot_id):
+    def get_snapshot(self, snapshot_id, timeout=None):
         """Returns details of snapshot identyfied by `snapshot_id` parameter"""
 
         request = self._build_request_url(
             [self.REQUEST_SNAPSHOTS, snapshot_id])
 
-        return self._process_request(request)
+        return self._process_request(request, timeout=timeout,
+                                     endpoint='snapshots/<id>')
 
-    def delete_snapshots(self):
+    def delete_snapshots(self, timeout=None):
         """Deletes all snapshots"""
 
         request = self._build_request_url(
             [self.REQUEST_SNAPSHOTS, self.REQUEST_SNAPSHOTS_LIST])
 
-        return self._process_request(request, 'DELETE')
+        return self._process_request(request, 'DELETE', timeout=timeout,
+                                     endpoint='snapshots/list')
+
+
+_rest_client = None
+
+
+def get_rest_client():
+    """Get a shared instance of DevControllerRestClient. The instance is
+    recreated if controller URL in configuration changes."""
+    global _rest_client
+
+    rest_url = ConfigLoader.snapshot().get_rest_url()
+    if _rest_client is None or _rest_client.rest_url != rest_url:
+        _rest_client = DevControllerRestClient(rest_url)
+    return _rest_client
 
 
 def convert_to_simple_value_format(internal_json):
@@ -23,14 +23,85 @@
 
 from __future__ import absolute_import
 
+from ros3dui.system import trace
+from ros3dui.system.util import write_state, read_state
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from tornado.process import Subprocess
+from tornado.stack_context import NullContext
+from collections import OrderedDict
+from datetime import timedelta
+import errno
+import fcntl
 import logging
+import os
 import os.path
 import subprocess
+import time
 
 
 _log = logging.getLogger(__name__)
 
 
+class ReloadJob(object):
+    """Background service reload job. `future` is resolved with True if
+    services were reloaded successfuly, False otherwise."""
+
+    STATE_PENDING = 'pending'
+    STATE_RUNNING = 'running'
+    STATE_DONE = 'done'
+    STATE_FAILED = 'failed'
+
+    def __init__(self, job_id, services):
+        self.id = job_id
+        self.services = list(services)
+        self.state = self.STATE_PENDING
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        # set once coalescing delay passed
+        self.due = False
+        self.future = Future()
+
+    def add_services(self, services):
+        for service in services:
+            if service not in self.services:
+                self.services.append(service)
+
+    def finish(self, success):
+        self.finished = time.time()
+        if success:
+            self.state = self.STATE_DONE
+        else:
+            self.state = self.STATE_FAILED
+        self.future.set_result(success)
+
+    def is_finished(self):
+        return self.state in (self.STATE_DONE, self.STATE_FAILED)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Restore job from `to_dict()` output, the job's `future` is
+        never resolved"""
+        job = cls(data['id'], data['services'])
+        job.state = data['state']
+        job.created = data['created']
+        job.started = data['started']
+        job.finished = data['finished']
+        return job
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'services': self.services,
+            'state': self.state,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
 class ServiceReloader(object):
     """Helper wrapper class for reloading changed services. The class
     interacts with the system via a wrapper that is normally delivered
@@ -54,6 +125,16 @@ class ServiceReloader(object):
     The script shall return a 0 status if services were restarted
     successfuly.
 
+    `reload_async()` runs the helper in background. Reload requests
+    made within `COALESCE_DELAY` seconds are merged into a single job,
+    requests made while a job is running are merged into the next
+    one. Recent jobs can be looked up with `get_job()`.
+
+    Jobs run in the process that created them. When running multiple
+    worker processes call `share_jobs()` in each worker, so that job
+    state is published to the state directory and jobs of other
+    workers can be looked up as well. Jobs of different workers are
+    then serialized with a lock file in the state directory.
     """
     HELPER_SCRIPT = 'ros3d-ui-service-reload'
     HELPERS_DIR = None
@@ -70,6 +151,30 @@ class ServiceReloader(object):
         SERVICE_PLATFORM
     ]
 
+    # seconds to wait for more reload requests before running a job
+    COALESCE_DELAY = 2.0
+    # number of finished jobs to keep
+    JOBS_HISTORY = 16
+
+    # seconds between state file checks when waiting for a job of
+    # another worker
+    POLL_INTERVAL = 0.5
+
+    _jobs = OrderedDict()
+    _next_job_id = 1
+    _job_id_step = 1
+    _state_dir = None
+    _pending_job = None
+    _running_job = None
+
+    @classmethod
+    def share_jobs(cls, state_dir, worker, workers):
+        """Publish job state in `state_dir`. `worker` is the index of
+        current worker process, out of `workers` processes. Job IDs are
+        allocated so that they do not clash between workers."""
+        cls._state_dir = state_dir
+        cls._next_job_id = worker + 1
+        cls._job_id_step = workers
 
     @classmethod
     def set_helpers_dir(cls, helpers_dir):
@@ -89,25 +194,208 @@ class ServiceReloader(object):
 
     @classmethod
     def reload(cls, services):
-        if not cls.HELPERS_DIR:
-            _log.warning('helpers directory not set')
-            return False
-
+        """Reload services synchronously"""
         cls.check_services(services)
 
-        helper_script = os.path.join(cls.HELPERS_DIR,
-                                     cls.HELPER_SCRIPT)
-        if not os.path.exists(helper_script):
-            _log.warning('helper script %s does not exist', helper_script)
+        args = cls._get_helper_args(services)
+        if not args:
             return False
 
-        args = [helper_script]
-        for service in services:
-            args.append(service)
-
+        start = time.time()
         retcode = subprocess.call(args)
+        trace.record(trace.SUBPROCESS, cls.HELPER_SCRIPT,
+                     time.time() - start, retcode != 0)
         if retcode != 0:
             _log.error('service reload failed')
             return False
 
         return True
+
+    @classmethod
+    def _get_helper_args(cls, services):
+        """Get helper script command line or None if helper is not
+        available"""
+        if not cls.HELPERS_DIR:
+            _log.warning('helpers directory not set')
+            return None
+
+        helper_script = os.path.join(cls.HELPERS_DIR,
+                                     cls.HELPER_SCRIPT)
+        if not os.path.exists(helper_script):
+            _log.warning('helper script %s does not exist', helper_script)
+            return None
+
+        return [helper_script] + list(services)
+
+    @classmethod
+    def reload_async(cls, services):
+        """Request a background reload of `services`. Returns ReloadJob
+        the services were added to."""
+        cls.check_services(services)
+
+        job = cls._pending_job
+        if job:
+            _log.debug('adding services %s to pending job %d',
+                       services, job.id)
+            job.add_services(services)
+            cls._save_job(job)
+            return job
+
+        job = ReloadJob(cls._next_job_id, services)
+        cls._next_job_id += cls._job_id_step
+        cls._jobs[job.id] = job
+        while len(cls._jobs) > cls.JOBS_HISTORY:
+            _, old_job = cls._jobs.popitem(last=False)
+            cls._drop_job(old_job)
+        cls._pending_job = job
+        cls._save_job(job)
+        _log.debug('new reload job %d for services %s', job.id, services)
+
+        # the job outlives the request that created it, do not carry
+        # request's context over
+        with NullContext():
+            IOLoop.current().call_later(cls.COALESCE_DELAY,
+                                        cls._job_due, job)
+        return job
+
+    @classmethod
+    def get_job(cls, job_id):
+        """Get reload job with `job_id` or None"""
+        job = cls._jobs.get(job_id)
+        if not job:
+            job = cls._load_job(job_id)
+        return job
+
+    @classmethod
+    @gen.coroutine
+    def wait_job(cls, job, timeout):
+        """Wait up to `timeout` seconds for `job` to finish. Returns the
+        most recent state of the job."""
+        if job.id in cls._jobs:
+            try:
+                yield gen.with_timeout(timedelta(seconds=timeout), job.future)
+            except gen.TimeoutError:
+                pass
+            raise gen.Return(job)
+
+        # job of another worker, watch its state file
+        deadline = time.time() + timeout
+        while not job.is_finished() and time.time() < deadline:
+            yield gen.sleep(cls.POLL_INTERVAL)
+            job = cls._load_job(job.id) or job
+        raise gen.Return(job)
+
+    @classmethod
+    def _job_path(cls, job_id):
+        return os.path.join(cls._state_dir, 'reload-job-%d.json' % (job_id))
+
+    @classmethod
+    def _save_job(cls, job):
+        if not cls._state_dir:
+            return
+        try:
+            write_state(cls._job_path(job.id), job.to_dict())
+        except (IOError, OSError):
+            _log.exception('failed to save reload job %d', job.id)
+
+    @classmethod
+    def _load_job(cls, job_id):
+        if not cls._state_dir:
+            return None
+        try:
+            data = read_state(cls._job_path(job_id))
+        except ValueError:
+            _log.exception('failed to load reload job %d', job_id)
+            return None
+        if data is None:
+            return None
+        return ReloadJob.from_dict(data)
+
+    @classmethod
+    def _drop_job(cls, job):
+        if not cls._state_dir:
+            return
+        try:
+            os.unlink(cls._job_path(job.id))
+        except OSError:
+            pass
+
+    @classmethod
+    def _job_due(cls, job):
+        job.due = True
+        cls._start_pending()
+
+    @classmethod
+    def _start_pending(cls):
+        job = cls._pending_job
+        if not job or not job.due or cls._running_job:
+            return
+
+        cls._pending_job = None
+        cls._running_job = job
+        cls._run_job(job)
+
+    @classmethod
+    @gen.coroutine
+    def _run_job(cls, job):
+        success = False
+        lock = None
+        try:
+            lock = yield cls._acquire_lock(job)
+
+            _log.info('reload job %d, services: %s', job.id, job.services)
+            job.state = ReloadJob.STATE_RUNNING
+            job.started = time.time()
+            cls._save_job(job)
+
+            args = cls._get_helper_args(job.services)
+            if args:
+                Subprocess.initialize()
+                start = time.time()
+                proc = Subprocess(args)
+                retcode = yield proc.wait_for_exit(raise_error=False)
+                trace.record(trace.SUBPROCESS, cls.HELPER_SCRIPT,
+                             time.time() - start, retcode != 0)
+                if retcode != 0:
+                    _log.error('service reload failed')
+                else:
+                    success = True
+        except Exception:
+            _log.exception('service reload job %d failed', job.id)
+        finally:
+            if lock is not None:
+                os.close(lock)
+
+        job.finish(success)
+        cls._save_job(job)
+        _log.info('reload job %d finished, state: %s', job.id, job.state)
+
+        cls._running_job = None
+        cls._start_pending()
+
+    @classmethod
+    @gen.coroutine
+    def _acquire_lock(cls, job):
+        """Wait for the reload lock shared by workers, so that reload
+        jobs of different workers do not run at the same time. Returns
+        the file descriptor holding the lock, to be closed once the job
+        is done, or None if jobs are not shared."""
+        if not cls._state_dir:
+            raise gen.Return(None)
+
+        fd = os.open(os.path.join(cls._state_dir, 'reload.lock'),
+                     os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        try:
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except IOError as err:
+                    if err.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+                _log.debug('reload job %d waits for other worker', job.id)
+                yield gen.sleep(cls.POLL_INTERVAL)
+        except Exception:
+            os.close(fd)
+            raise
+        raise gen.Return(fd)
@@ -0,0 +1,194 @@
+#
+# Copyright (c) 2015 Open-RnD Sp. z o.o.
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Accounting of expensive operations (D-Bus calls, REST fetches,
+subprocesses, template renders) made on behalf of a request. The trace
+of current request is kept thread local. Within IOLoop thread it
+follows the request's callbacks through a StackContext, blocking calls
+run by worker threads carry the trace of the request that submitted
+them.
+
+Observers registered with add_observer() are told about every recorded
+operation, whether it happened within a request or not."""
+
+from __future__ import absolute_import
+
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+_log = logging.getLogger(__name__)
+
+DBUS = 'dbus'
+REST = 'rest'
+SUBPROCESS = 'subprocess'
+TEMPLATE = 'template'
+
+CATEGORIES = [DBUS, REST, SUBPROCESS, TEMPLATE]
+
+_local = threading.local()
+_observers = []
+
+
+class BudgetExceeded(AssertionError):
+    """Raised when operations count exceeds given budget"""
+    pass
+
+
+class Trace(object):
+    """Counts and total durations of operations, per category"""
+
+    def __init__(self, url=None):
+        self.url = url
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.counts = dict((category, 0) for category in CATEGORIES)
+        self.durations = dict((category, 0.0) for category in CATEGORIES)
+
+    def add(self, category, duration):
+        with self.lock:
+            self.counts[category] += 1
+            self.durations[category] += duration
+
+
+def current():
+    """Trace of current request or None"""
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def activate(trace):
+    """Make `trace` current in calling thread"""
+    previous = current()
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+
+def add_observer(observer):
+    """Register `observer`, called with category, name (ex. D-Bus
+    interface), duration in seconds and error flag of every recorded
+    operation"""
+    global _observers
+    # replaced rather than modified, record() may run in other threads
+    _observers = _observers + [observer]
+
+
+def remove_observer(observer):
+    """Unregister `observer` added with add_observer()"""
+    global _observers
+    _observers = [registered for registered in _observers
+                  if registered != observer]
+
+
+def record(category, name, duration, error=False):
+    """Record an operation of `category` that took `duration` seconds"""
+    trace = current()
+    if trace is not None:
+        trace.add(category, duration)
+    for observer in _observers:
+        try:
+            observer(category, name, duration, error)
+        except Exception:
+            _log.exception('trace observer failed')
+
+
+@contextmanager
+def timed(category, name=None):
+    """Record duration of code run within the context"""
+    start = time.time()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        record(category, name, time.time() - start, error)
+
+
+def check_budget(counts, **budget):
+    """Raise BudgetExceeded if any of `counts` (category -> count) exceeds
+    its `budget`, ex. check_budget(counts, dbus=10, rest=1)"""
+    exceeded = ['{} {} > {}'.format(category, counts.get(category, 0), limit)
+                for category, limit in sorted(budget.items())
+                if counts.get(category, 0) > limit]
+    if exceeded:
+        raise BudgetExceeded('budget exceeded: ' + ', '.join(exceeded))
+
+
+class Budget(object):
+    """Context that fails with BudgetExceeded if code run within it
+    makes more operations than allowed, ex.
+
+      with Budget(dbus=12):
+          provider.list_interfaces(DETAIL_CONFIG)
+    """
+
+    def __init__(self, **budget):
+        self.budget = budget
+        self.trace = Trace()
+        self._activation = None
+
+    def __enter__(self):
+        self._activation = activate(self.trace)
+        self._activation.__enter__()
+        return self.trace
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._activation.__exit__(exc_type, exc_value, tb)
+        if exc_type is None:
+            check_budget(self.trace.counts, **self.budget)
+
+
+# proxy attributes that do not result in a method call
+_NOT_CALLS = frozenset(['connect_to_signal', 'get_dbus_method'])
+
+
+class _TracedMethod(object):
+
+    def __init__(self, method, interface):
+        self._method = method
+        self.interface = interface
+
+    def __call__(self, *args, **kwargs):
+        if 'reply_handler' in kwargs:
+            # asynchronous call, recorded by the caller once completed
+            return self._method(*args, **kwargs)
+        with timed(DBUS, kwargs.get('dbus_interface', self.interface)):
+            return self._method(*args, **kwargs)
+
+
+class TracedInterface(object):
+    """Wrapper of dbus.Interface proxy that records all method calls"""
+
+    def __init__(self, iface):
+        self._iface = iface
+
+    def __getattr__(self, name):
+        attr = getattr(self._iface, name)
+        if name.startswith('_') or name in _NOT_CALLS or not callable(attr):
+            return attr
+        return _TracedMethod(attr, self._iface.dbus_interface)
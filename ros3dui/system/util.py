@@ -26,9 +26,53 @@ import logging
 import ConfigParser
 import os.path
 import os
+import stat
+import json
+import tempfile
+import threading
+
+
+def _copy_config(config):
+    """Make a copy of ConfigParser instance"""
+    copied = ConfigParser.ConfigParser()
+    for key, value in config.defaults().items():
+        copied.set('DEFAULT', key, value)
+    for section in config.sections():
+        copied.add_section(section)
+        # items() would mix in DEFAULT options, copy only options set
+        # in the section itself
+        for key, value in config._sections[section].items():
+            if key == '__name__':
+                continue
+            copied.set(section, key, value)
+    return copied
+
+
+class _ReadOnlyConfig(object):
+    """Read-only view of ConfigParser instance shared by snapshots"""
+
+    _MODIFIERS = frozenset(['set', 'add_section', 'remove_section',
+                            'remove_option', 'read', 'readfp'])
+
+    def __init__(self, config):
+        self._config = config
+
+    def __getattr__(self, name):
+        if name in self._MODIFIERS:
+            raise RuntimeError('configuration snapshot is read-only')
+        return getattr(self._config, name)
+
 
 class ConfigLoader(object):
-    """Ros3D system configuration loader"""
+    """Ros3D system configuration loader. Parsed configuration is shared
+    by all loaders and parsed again only if the configuration file
+    changes (checked by modification time, size and inode). Use
+    `snapshot()` to obtain a read-only loader using the shared parsed
+    configuration directly, regular loaders work on a private copy
+    that can be modified and written back with `write()`. Only the
+    options changed through the loader are written, on top of the
+    current configuration, so that concurrent writers do not drop each
+    other's changes."""
 
     DEFAULT_PATH = '/etc/ros3d.conf'
     DEFAULT_REST_URL = 'http://localhost:8090'
@@ -36,18 +80,71 @@ class ConfigLoader(object):
 
     logger = logging.getLogger(__name__)
 
-    def __init__(self, path=None):
+    # path -> (file stat key, parsed configuration)
+    _cache = {}
+    _cache_lock = threading.Lock()
+    # serializes configuration writes
+    _write_lock = threading.Lock()
+
+    def __init__(self, path=None, readonly=False):
         self.config = None
+        self.readonly = readonly
+        # options changed with this loader, (section, name, value)
+        self.changes = []
         self._load_config(path if path else ConfigLoader.CONFIG_PATH)
 
+    @classmethod
+    def snapshot(cls, path=None):
+        """Get read-only loader of current configuration"""
+        return cls(path, readonly=True)
+
+    @staticmethod
+    def _stat_key(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size, st.st_ino)
+
+    @classmethod
+    def _get_parsed(cls, path):
+        """Get shared parsed configuration from file `path`, parsing the file
+        if it changed"""
+        key = cls._stat_key(path)
+        with cls._cache_lock:
+            cached = cls._cache.get(path)
+            if cached and cached[0] == key and key is not None:
+                return cached[1]
+
+            cls.logger.debug('loading configuration from %s', path)
+            config = ConfigParser.ConfigParser()
+            loaded = config.read(path)
+            if not loaded:
+                cls.logger.error('failed to load configuration from %s',
+                                 path)
+            cls._cache[path] = (key, config)
+            return config
+
     def _load_config(self, path):
         """Load configuration from file given by `path`"""
-        self.config = ConfigParser.ConfigParser()
+        parsed = self._get_parsed(path)
+        if self.readonly:
+            self.config = _ReadOnlyConfig(parsed)
+        else:
+            self.config = _copy_config(parsed)
+
+    def _check_writable(self):
+        if self.readonly:
+            raise RuntimeError('configuration snapshot is read-only')
 
-        loaded = self.config.read(path)
-        if not loaded:
-            self.logger.error('failed to load configuration from %s',
-                              path)
+    def _set(self, section, name, value):
+        """Set option `name` in `section`, the change is recorded to be
+        applied by write()"""
+        self._check_writable()
+        if not self.config.has_section(section):
+            self.config.add_section(section)
+        self.config.set(section, name, value)
+        self.changes.append((section, name, value))
 
     def _get(self, section, name, default=None):
         """Try to get an option from configuration. If option is not found,
@@ -65,20 +162,16 @@ class ConfigLoader(object):
         return sys_name
 
     def set_system(self, value):
-        if not self.config.has_section('common'):
-            self.config.add_section('common')
         if value == None:
             value = ''
-        self.config.set('common', 'system', value)
+        self._set('common', 'system', value)
 
     def get_aladin(self):
         """Get Aladin control mode"""
         return self._get('common', 'aladin', 'READ_ONLY')
 
     def set_aladin(self, value):
-        if not self.config.has_section('common'):
-            self.config.add_section('common')
-        self.config.set('common', 'aladin', value)
+        self._set('common', 'aladin', value)
 
     def get_rest_url(self):
         """Get ROS3D dev controller REST API url"""
@@ -88,13 +181,31 @@ class ConfigLoader(object):
         import tempfile
         import shutil
 
-        fd, path = tempfile.mkstemp()
-        self.logger.debug('writing config to temp file: %s', path)
-        with os.fdopen(fd, 'w') as outf:
-            self.config.write(outf)
+        self._check_writable()
+
+        path = ConfigLoader.CONFIG_PATH
+        with ConfigLoader._write_lock:
+            # apply own changes to current configuration, it may have
+            # been written since this loader was created
+            config = _copy_config(self._get_parsed(path))
+            for section, name, value in self.changes:
+                if not config.has_section(section):
+                    config.add_section(section)
+                config.set(section, name, value)
 
-        self.logger.debug('replacing %s', ConfigLoader.CONFIG_PATH)
-        shutil.move(path, ConfigLoader.CONFIG_PATH)
+            fd, tmppath = tempfile.mkstemp()
+            self.logger.debug('writing config to temp file: %s', tmppath)
+            with os.fdopen(fd, 'w') as outf:
+                config.write(outf)
+
+            self.logger.debug('replacing %s', path)
+            shutil.move(tmppath, path)
+
+            # written configuration becomes the shared one
+            with ConfigLoader._cache_lock:
+                ConfigLoader._cache[path] = (self._stat_key(path), config)
+            self.config = _copy_config(config)
+            self.changes = []
 
     @classmethod
     def set_config_location(cls, path):
@@ -115,3 +226,48 @@ def get_hostname():
             hostname = inf.read().strip()
 
     return hostname
+
+
+def prepare_state_dir(path):
+    """Create a private state directory at `path` or, if it exists,
+    check that it is a directory owned by us and not accessible by
+    others. Files left over from previous runs are removed. Raises
+    RuntimeError if the directory cannot be used."""
+    try:
+        os.mkdir(path, 0o700)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.geteuid() \
+       or stat.S_IMODE(st.st_mode) & 0o077:
+        raise RuntimeError('state directory %s is not private' % (path))
+
+    for name in os.listdir(path):
+        os.unlink(os.path.join(path, name))
+
+
+def write_state(path, data):
+    """Atomically replace JSON state file at `path` with `data`. The
+    file is created in the same directory with a unique name first,
+    so the directory needs to be private, see `prepare_state_dir()`"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                    prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as outf:
+            json.dump(data, outf)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def read_state(path):
+    """Read JSON state file at `path`, returns None if the file does not
+    exist"""
+    try:
+        with open(path) as inf:
+            return json.load(inf)
+    except IOError:
+        return None
@@ -22,54 +22,46 @@
 # SOFTWARE.
 
 from __future__ import absolute_import
-from ros3dui.system.network import network_provider
-from ros3dui.system.camera import get_camera_manager, CameraManagerError
-from ros3dui.system.util import ConfigLoader, get_hostname
+from ros3dui.system.network import (network_provider, DETAIL_CONFIG,
+                                    NetworkConfigError)
+from ros3dui.system.util import ConfigLoader
 from ros3dui.system.services import ServiceReloader
-from ros3dui.system.rest_client import DevControllerRestClient, convert_to_simple_value_format
+from ros3dui.system.rest_client import get_rest_client, convert_to_simple_value_format
+from ros3dui.system.asyncbus import run_blocking
+from ros3dui.web.templates import TemplateLoader
+from ros3dui.web.widgets import WidgetRenderer
+from ros3dui.web.status import (StatusCollector, ALADIN_MODES, UPTIME_ENTRY,
+                                 list_interfaces, get_boot_time)
+from ros3dui.web.push import StatusPublisher, cell_id
+from ros3dui.web.pages import PageCache, write_page
+from ros3dui.web import assets
+from ros3dui.web.tracing import TracedRequestHandler
+from ros3dui.web.metrics import Metrics
 import tornado.web
-import tornado.template
-from tornado.escape import parse_qs_bytes
+from tornado import gen
+from tornado.escape import parse_qs_bytes, utf8
+from tornado.concurrent import Future
+import hashlib
+import json
 import logging
 import os.path
 import os
-from functools import partial
 from subprocess import call
 from threading import Timer
 
 _log = logging.getLogger(__name__)
 
 
-def widget_render(ldr, widget):
-    """Render a form widget using a template loder and widget
-    description. Widget description is a dict with fields:
-    - id - used as field id/name
-    - value - field value or None
-    - type - dropdown/input/password/plain etc.
+class SystemSettingsHandler(TracedRequestHandler):
 
-    Dropdown widgets will produce a dropbox. Input/password produce a
-    one line text input (password uses masking characters). Plain,
-    outputs entry's value as it is.
-    """
-    _log.debug('render widget: %s', widget)
-    tmpl = ldr.load('widgets.html')
-    return tmpl.generate(entry=widget)
-
-
-class SystemSettingsHandler(tornado.web.RequestHandler):
-
-    aladin_modes_get = {'READ_ONLY':'Read only',
-                        'INTERACTIVE':'Interactive'}
+    aladin_modes_get = ALADIN_MODES
     aladin_modes_post = {v: k for k, v in aladin_modes_get.items()}
 
     def initialize(self, app):
         self.app = app
 
     def get(self):
-        ldr = self.app.get_template_loader()
-        tmpl = ldr.load('system_settings.html')
-
-        config = ConfigLoader()
+        config = ConfigLoader.snapshot()
         rig = config.get_system()
         if not rig:
             rig = None
@@ -84,9 +76,14 @@ class SystemSettingsHandler(tornado.web.RequestHandler):
                                        id='controll_aladin',
                                        options=list(SystemSettingsHandler.aladin_modes_get.values())))
 
-        self.write(tmpl.generate(system_entries=system_entries,
+        def _render(tmpl):
+            widget_render = self.app.widgets.batch(system_entries)
+            return tmpl.generate(system_entries=system_entries,
                                  configuration_active=True,
-                                 widget_render=partial(widget_render, ldr)))
+                                 widget_render=widget_render)
+
+        write_page(self, self.app.pages.get('system_settings.html',
+                                            system_entries, _render))
 
 
     def post(self):
@@ -126,27 +123,49 @@ class SystemSettingsHandler(tornado.web.RequestHandler):
                 config.set_aladin(aladin)
                 need_reload.append(ServiceReloader.SERVICE_SERVO)
 
-        # update configuration file
-        config.write()
-
         if need_reload:
+            # update configuration file
+            config.write()
+
             _log.info('services needing reload: %s', need_reload)
-            ServiceReloader.reload(need_reload)
-            _log.info('reload complete')
+            job = ServiceReloader.reload_async(need_reload)
+            self.redirect('/?config_applied=1&reload_job=%d' % (job.id))
+            return
 
         self.redirect('/?config_applied=1')
 
 
-class NetworkSettingsHandler(tornado.web.RequestHandler):
+class ReloadJobHandler(TracedRequestHandler):
+    """Status of background service reload job. Pass `wait=1` to wait
+    for the job to complete."""
+
+    WAIT_TIMEOUT = 30
+
+    @gen.coroutine
+    def get(self, job_id):
+        job = ServiceReloader.get_job(int(job_id))
+        if not job:
+            raise tornado.web.HTTPError(404)
+
+        if self.get_argument('wait', None) == '1':
+            job = yield ServiceReloader.wait_job(job, self.WAIT_TIMEOUT)
+            if not job.is_finished():
+                _log.debug('reload job %d still not finished', job.id)
+
+        self.write(job.to_dict())
+
+
+def _set_network_config(config):
+    network_provider().set_config(config)
+
+
+class NetworkSettingsHandler(TracedRequestHandler):
     def initialize(self, app):
         self.app = app
 
+    @gen.coroutine
     def get(self):
-        ldr = self.app.get_template_loader()
-        tmpl = ldr.load('network_settings.html')
-
-        config = ConfigLoader()
-        net = network_provider().list_interfaces()
+        net = yield run_blocking(list_interfaces, DETAIL_CONFIG)
         wired = net['wired'][0]
         if bool(net.get('wireless', [])):
             wireless = net['wireless'][0]
@@ -228,11 +247,17 @@ class NetworkSettingsHandler(tornado.web.RequestHandler):
         if self.app.mode == self.app.MODE_KR:
             network_entries['wireless'] = wireless_entry
 
-        self.write(tmpl.generate(network_entries=network_entries,
+        def _render(tmpl):
+            widget_render = self.app.widgets.batch(*network_entries.values())
+            return tmpl.generate(network_entries=network_entries,
                                  configuration_active=True,
-                                 widget_render=partial(widget_render, ldr)))
+                                 widget_render=widget_render)
+
+        write_page(self, self.app.pages.get('network_settings.html',
+                                            network_entries, _render))
 
 
+    @gen.coroutine
     def post(self):
         _log.debug('configuration set: %s' , self.request)
         _log.debug('body: %s', self.request.body)
@@ -286,110 +311,32 @@ class NetworkSettingsHandler(tornado.web.RequestHandler):
         wireless_config['name'] = get_arg('wifi_ap_name')
         wireless_config['password'] = get_arg('wifi_psk_pass')
 
-        net = network_provider()
         net_config = {
             'wired': [wired_config],
         }
         if self.app.mode == self.app.MODE_KR:
             net_config['wireless'] = [wireless_config]
 
-        net.set_config(net_config)
-
-        config = ConfigLoader()
-        config.write()
+        # interfaces are independent, configure them concurrently
+        try:
+            yield [run_blocking(_set_network_config, {key: conf})
+                   for key, conf in net_config.items()]
+        except NetworkConfigError:
+            _log.exception('failed to apply network configuration')
+            self.redirect('/?config_failed=1')
+            return
 
         self.redirect('/?config_applied=1')
 
 
-class MainHandler(tornado.web.RequestHandler):
-    def initialize(self, app):
-        self.app = app
-
-    def _uptime(self):
-        with open('/proc/uptime') as inf:
-            secs = float(inf.read().strip().split()[0])
-
-        days, rest = divmod(int(secs), 3600 * 24)
-        hours, rest = divmod(rest, 3600)
-        minutes, rest = divmod(rest, 60)
-        seconds = rest
-
-        uptime = '{}d {}h {}m {}s'.format(days, hours,
-                                          minutes, seconds)
-        _log.debug('system uptime: %s', str(uptime))
-        return str(uptime)
+class MainHandler(TracedRequestHandler):
 
-    def _net(self):
-        data = network_provider().list_interfaces()
+    UPTIME_PLACEHOLDER = '-'
 
-        network_entries = {
-           'wired': []
-        }
-        if self.app.mode == self.app.MODE_KR:
-            network_entries['wireless'] = []
-
-        # we're intersted in wired and wireless interfaces only
-        for itype in network_entries.keys():
-            if itype not in data:
-                # device status is present in interface data, assuming
-                # that there should be one add a status info that
-                # there is 'no device' at this time
-                network_entries[itype].append(dict(name='State', value='No device'))
-                _log.debug('interface type %s not in available interfaces',
-                           itype)
-                continue
-
-            entry = network_entries[itype]
-            # expecting only one interface
-            if len(data[itype]) > 1:
-                _log.error('more than 1 interface of type %s', itype)
-
-            idata = data[itype][0]
-            _log.debug('interface data: %s', idata)
-
-            ipv4 = idata.get('ipv4', None)
-            # first interface name
-            entry.append(dict(name='Interface', value=idata['device']))
-            # MAC address comes next
-            entry.append(dict(name='MAC Address', value=idata['mac']))
-            # interface status
-            if idata['online']:
-                entry.append(dict(name='State', value='Up'))
-
-                # add connected access point entry
-                if idata['type'] == 'wireless':
-                    entry.append(dict(name='Access Point', value=idata['name']))
-            else:
-                # may not be online but still usable with local addressing
-                if ipv4 and ipv4['address'].startswith('169.254'):
-                    entry.append(dict(name='State', value='Up/Local'))
-                else:
-                    entry.append(dict(name='State', value='Down'))
-
-            # now fill IPv4 status
-            if ipv4:
-                # address first
-                entry.append(dict(name='IPv4 Address', value=ipv4['address']))
-                # network mask
-                entry.append(dict(name='IPv4 Mask', value=ipv4['netmask']))
-                # gateway
-                entry.append(dict(name='IPv4 Gateway', value=ipv4.get('gateway', 'Not set')))
-                # IP address source, this can be either DHCP, static,
-                # or auto link-local. The connman provider returns
-                # DHCP when link-local address was configured
-                if ipv4['method'] == 'dhcp':
-                    method = 'DHCP'
-                    # override address source for link local addresses
-                    if ipv4['address'].startswith('169.254'):
-                        _log.debug('IP %s like link local address', ipv4['address'])
-                        method = 'Link Local'
-                else:
-                    method = 'Static'
-                entry.append(dict(name='Address Source', value=method))
-
-        _log.debug('network entries: %s', network_entries)
-        return network_entries
+    def initialize(self, app):
+        self.app = app
 
+    @gen.coroutine
     def get(self):
         _log.debug("get: %r", self.request)
 
@@ -397,66 +344,159 @@ class MainHandler(tornado.web.RequestHandler):
         if config_applied == '1':
             config_applied = True
 
+        config_failed = self.get_argument('config_failed', False)
+        if config_failed == '1':
+            config_failed = True
+
         reboot_applied = self.get_argument('reboot_applied', False)
         if reboot_applied == '1':
             reboot_applied = True
 
-        ldr = self.app.get_template_loader()
-        tmpl = ldr.load('status.html')
-
-        config = ConfigLoader()
-        rig = config.get_system()
-        if not rig:
-            rig = 'None'
+        reload_job = self.get_argument('reload_job', None)
+        if reload_job and not reload_job.isdigit():
+            reload_job = None
 
-        hostname = get_hostname()
-        if not hostname:
-            hostname = 'ros3d'
+        status = yield self.app.status.collect()
+        network_entries = status[StatusCollector.SOURCE_NETWORK]
+        camera_entries = status[StatusCollector.SOURCE_CAMERAS]
 
-        system_entries= [
-            dict(name='Hostname', value=hostname),
-            dict(name='Assigned Rig', value=rig)
-        ]
-
-        if self.app.mode == Application.MODE_KR:
-            aladin = config.get_aladin()
-            system_entries.append(dict(name='Aladin Control Mode',
-                                       value=SystemSettingsHandler.aladin_modes_get[aladin]))
-
-        system_entries.append(dict(name='Uptime', value=self._uptime()))
-        network_entries = self._net()
-        camera_entries = [
-                dict(name='Cam 1', value='Inactive'),
-                dict(name='Cam 2', value='Active')
-                ]
-        camera_entries = self._cam()
-        self.write(tmpl.generate(system_entries=system_entries,
+        # uptime changes all the time, it is not a part of the page, but
+        # filled in by status events pushed to the page (or computed
+        # from boot time by browsers not supporting them)
+        system_entries = [
+            dict(entry, value=self.UPTIME_PLACEHOLDER)
+            if entry['name'] == UPTIME_ENTRY else entry
+            for entry in status[StatusCollector.SOURCE_SYSTEM]]
+        boot_time = get_boot_time()
+
+        def _render(tmpl):
+            widget_render = self.app.widgets.batch(system_entries,
+                                                   *(network_entries.values() +
+                                                     camera_entries.values()))
+            return tmpl.generate(system_entries=system_entries,
                                  network_entries=network_entries,
                                  camera_entries=camera_entries,
                                  config_applied=config_applied,
+                                 config_failed=config_failed,
                                  reboot_applied=reboot_applied,
+                                 reload_job=reload_job,
                                  system_active=True,
-                                 widget_render=partial(widget_render, ldr)))
+                                 widget_render=widget_render,
+                                 cell_id=cell_id,
+                                 uptime_cell=cell_id(StatusCollector.SOURCE_SYSTEM,
+                                                     UPTIME_ENTRY),
+                                 boot_time=boot_time)
+
+        if reload_job:
+            # page of a single reload job, not worth caching
+            ldr = self.app.get_template_loader()
+            self.write(_render(ldr.load('status.html')))
+            return
+
+        state = dict(status, boot_time=boot_time)
+        state[StatusCollector.SOURCE_SYSTEM] = system_entries
+        page = self.app.pages.get('status.html', state, _render,
+                                  variant=(config_applied == True,
+                                           config_failed == True,
+                                           reboot_applied == True))
+        write_page(self, page)
+
+
+class StatusEventsHandler(TracedRequestHandler):
+    """Stream of status changes as Server-Sent Events. Each `update`
+    event carries a JSON object of changed cells, cell ID -> value"""
 
-    def _cam(self):
-        entries = {}
-        try:
-            camera_data = get_camera_manager().get_details()
-        except CameraManagerError:
-            entries['Error']= [dict(name='Controller service unavailable',
-                value='')]
-        else:
-            if not camera_data:
-                entries['Warning'] = [dict(name='No cameras found', value='')]
-            else:
-                for idx, camera in enumerate(camera_data):
-                    name = 'Camera ' + str(idx+1)
-                    entries[name] = []
-                    entries[name].append(camera)
-        return entries
+    def initialize(self, app):
+        self.app = app
+        self.closed = None
+
+    @gen.coroutine
+    def get(self):
+        self.set_header('Content-Type', 'text/event-stream')
+        self.set_header('Cache-Control', 'no-cache')
+        self.closed = Future()
+        self.app.publisher.subscribe(self.send)
+        yield self.closed
+
+    def send(self, changed):
+        self.write('event: update\ndata: %s\n\n' % json.dumps(changed))
+        self.flush().add_done_callback(self._flushed)
+
+    def _flushed(self, future):
+        if future.exception() is not None:
+            self.on_connection_close()
+
+    def on_connection_close(self):
+        self.app.publisher.unsubscribe(self.send)
+        if self.closed and not self.closed.done():
+            self.closed.set_result(None)
+
+
+class ApiStatusHandler(TracedRequestHandler):
+    """Status data as JSON, in format of StatusCollector.collect_data().
+    The whole status is served at /api/status, single source at
+    /api/status/<source>. Responses carry a strong ETag derived from
+    the data, a poll with matching If-None-Match gets 304 without a
+    body."""
+
+    def initialize(self, app):
+        self.app = app
+        self.etag = None
+
+    @gen.coroutine
+    def get(self, source=None):
+        sources = [source] if source else None
+        status = yield self.app.status.collect_data(sources)
 
+        system = status.get(StatusCollector.SOURCE_SYSTEM)
+        if system:
+            # uptime changes with every poll, boot time is there so
+            # that unchanged system status keeps its ETag
+            system = dict(system)
+            system.pop('uptime', None)
+            status[StatusCollector.SOURCE_SYSTEM] = system
 
-class RebootHandler(tornado.web.RequestHandler):
+        data = status[source] if source else status
+        body = utf8(json.dumps(data, sort_keys=True))
+        self.etag = '"%s"' % hashlib.sha1(body).hexdigest()
+
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.set_header('Cache-Control', 'no-cache')
+        self.write(body)
+
+    def compute_etag(self):
+        return self.etag
+
+
+class MetricsHandler(TracedRequestHandler):
+    """Application metrics in Prometheus text format"""
+
+    def initialize(self, app):
+        self.app = app
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(self.app.metrics.render())
+
+
+class StallsHandler(TracedRequestHandler):
+    """IOLoop stalls recorded by stall detector, 404 if detector is not
+    enabled"""
+
+    def initialize(self, app):
+        self.app = app
+
+    def get(self):
+        detector = self.app.stall_detector
+        if not detector:
+            raise tornado.web.HTTPError(404)
+
+        self.write(dict(threshold=detector.threshold,
+                        count=detector.count,
+                        stalls=detector.get_stalls()))
+
+
+class RebootHandler(TracedRequestHandler):
     def initialize(self, app):
         self.app = app
 
@@ -470,29 +510,29 @@ class RebootHandler(tornado.web.RequestHandler):
         call(["reboot", "now"])
 
 
-class SnapshotsHandler(tornado.web.RequestHandler):
+class SnapshotsHandler(TracedRequestHandler):
     """Handler for parameter snapshots requests"""
 
     def initialize(self, app):
         self.app = app
 
+    @gen.coroutine
     def get(self):
         _log.debug("get snapshots request")
 
         ldr = self.app.get_template_loader()
         tmpl = ldr.load('snapshots.html')
 
-        rest = DevControllerRestClient()
-        snapshots = rest.get_snapshots_list()
+        snapshots = yield get_rest_client().get_snapshots_list()
 
         self.write(tmpl.generate(snapshots=snapshots, parameters_active=True))
 
+    @gen.coroutine
     def delete(self):
-        rest = DevControllerRestClient()
-        rest.delete_snapshots()
+        yield get_rest_client().delete_snapshots()
 
 
-class ShotcalcHandler(tornado.web.RequestHandler):
+class ShotcalcHandler(TracedRequestHandler):
     """Handler for main site of shot calculator"""
 
     def initialize(self, app):
@@ -510,14 +550,14 @@ class ShotcalcHandler(tornado.web.RequestHandler):
         self.write(tmpl.generate(parameters_active=True))
 
 
-class SnapshotDownloadHandler(tornado.web.RequestHandler):
+class SnapshotDownloadHandler(TracedRequestHandler):
     """Handler for parameter snapshots requests"""
 
+    @gen.coroutine
     def get(self, snapshot_id):
         _log.debug("get snapshot request, id %s", snapshot_id)
 
-        rest = DevControllerRestClient()
-        snapshot = rest.get_snapshot(snapshot_id)
+        snapshot = yield get_rest_client().get_snapshot(snapshot_id)
 
         self.write(convert_to_simple_value_format(snapshot))
 
@@ -526,7 +566,9 @@ class Application(tornado.web.Application):
     MODE_KR = 1
     MODE_AO = 2
 
-    def __init__(self, document_root, mode=MODE_KR):
+    def __init__(self, document_root, mode=MODE_KR,
+                 precompile_templates=False, production=False,
+                 trace_footer=False, asset_cache=None):
         self.mode = mode
         self.template_root = os.path.join(document_root,
                                           'templates')
@@ -535,28 +577,79 @@ class Application(tornado.web.Application):
         fonts_root = os.path.join(document_root, 'fonts')
 
         shotcalc_root = "/".join((document_root, 'shotcalc'))
+
+        # compressed variants of static files are built in
+        # `asset_cache`, if set, and served from there
+        compressed = {}
+        if asset_cache:
+            for name, root in [('static', self.static_root),
+                               ('fonts', fonts_root),
+                               ('shotcalc', shotcalc_root)]:
+                target = os.path.join(asset_cache, name)
+                if assets.build_compressed(root, target):
+                    compressed[name] = target
         uris = [
             (r"/network_settings", NetworkSettingsHandler, dict(app=self)),
             (r"/system_settings", SystemSettingsHandler, dict(app=self)),
             (r"/status", MainHandler, dict(app=self)),
+            (r"/status/events", StatusEventsHandler, dict(app=self)),
             (r"/reboot", RebootHandler, dict(app=self)),
-            (r"/fonts/(.*)", tornado.web.StaticFileHandler, dict(path=fonts_root)),
+            (r"/reload_job/([0-9]+)", ReloadJobHandler),
+            (r"/api/status", ApiStatusHandler, dict(app=self)),
+            (r"/metrics", MetricsHandler, dict(app=self)),
+            (r"/debug/stalls", StallsHandler, dict(app=self)),
+            (r"/api/status/(system|network|cameras)", ApiStatusHandler,
+             dict(app=self)),
+            (r"/fonts/(.*)", assets.StaticFileHandler,
+             dict(path=fonts_root, compressed_path=compressed.get('fonts'))),
             (r"/snapshots", SnapshotsHandler, dict(app=self)),
             (r"/snapshot/([0-9]+)", SnapshotDownloadHandler),
             (r"/shotcalc/", ShotcalcHandler, dict(app=self)),
-            (r"/shotcalc/(.*)", tornado.web.StaticFileHandler,
-             dict(path=shotcalc_root)),
+            (r"/shotcalc/(.*)", assets.StaticFileHandler,
+             dict(path=shotcalc_root,
+                  compressed_path=compressed.get('shotcalc'))),
             (r"/", MainHandler, dict(app=self)),
         ]
 
+        # development machinery (autoreload, debug mode, template
+        # modification checks) is disabled in production
         super(Application, self).__init__(uris,
-                                          autoreload=True,
-                                          debug=True,
-                                          static_path=self.static_root)
+                                          autoreload=not production,
+                                          debug=not production,
+                                          static_path=self.static_root,
+                                          static_handler_class=assets.StaticFileHandler,
+                                          static_handler_args=dict(
+                                              compressed_path=compressed.get('static')),
+                                          trace_footer=trace_footer)
 
         _log.debug('loading templates from: %s', self.template_root)
         _log.debug('static files from: %s', self.static_root)
-        # self.loader = tornado.template.Loader(template_root)
+        self.loader = TemplateLoader(self.template_root,
+                                     check_mtime=not production,
+                                     namespace=dict(static_url=self.static_url))
+        self.widgets = WidgetRenderer(self.loader)
+        self.set_status_collector(StatusCollector(self))
+        self.metrics = Metrics()
+        # StallDetector, set when stall detection is enabled
+        self.stall_detector = None
+        self.pages = PageCache(self.loader)
+        if precompile_templates:
+            self.loader.precompile()
 
     def get_template_loader(self):
-        return tornado.template.Loader(self.template_root)
+        return self.loader
+
+    def log_request(self, handler):
+        super(Application, self).log_request(handler)
+        self.metrics.observe_request(type(handler).__name__,
+                                     handler.get_status(),
+                                     handler.request.request_time())
+
+    def set_status_collector(self, collector):
+        """Use `collector` for collecting status data"""
+        self.status = collector
+        self.publisher = StatusPublisher(collector)
+
+    def static_url(self, path):
+        """URL of static file `path`, with content fingerprint"""
+        return assets.StaticFileHandler.make_static_url(self.settings, path)
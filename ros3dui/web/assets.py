@@ -0,0 +1,240 @@
+#
+# Copyright (c) 2015 Open-RnD Sp. z o.o.
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Static assets pipeline. Compressed variants of static files are
+built at startup in a cache directory, document root is not written
+to. Variants are named after the content hash of the original file, a
+variant is never served for content other than the one it was built
+from, regardless of file modification times. Variants are served in place of the originals to clients that
+accept them. Files referenced with a content fingerprint (?v=<hash>,
+see static_url()) are cached by browsers for good."""
+
+from __future__ import absolute_import
+
+import tornado.web
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os.path
+import os
+
+_log = logging.getLogger(__name__)
+
+# only these are worth compressing, images and archives are
+# compressed already
+COMPRESSIBLE = ['.css', '.js', '.html', '.svg', '.ttf', '.eot',
+                '.json', '.map', '.txt']
+# files smaller than this are sent as is
+MIN_SIZE = 512
+
+# encodings in order of preference, Accept-Encoding token -> extension
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def accepted_encodings(header, encodings):
+    """Get content codings from `encodings` accepted according to
+    Accept-Encoding header value `header`, in the same order. Codings
+    with q=0 are refused, `*` stands for codings not listed."""
+    qvalues = {}
+    for item in header.split(','):
+        params = item.split(';')
+        coding = params[0].strip().lower()
+        if not coding:
+            continue
+        qvalue = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0.0
+        qvalues[coding] = qvalue
+
+    return [coding for coding in encodings
+            if qvalues.get(coding, qvalues.get('*', 0.0)) > 0]
+
+
+def _brotli_compress(data):
+    import brotli
+    return brotli.compress(data)
+
+
+def _gzip_compress(path, data):
+    with open(path, 'wb') as outf:
+        with gzip.GzipFile(filename='', mode='wb', fileobj=outf,
+                           compresslevel=9, mtime=0) as out:
+            out.write(data)
+
+
+def _content_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def _variant_base(target, digest):
+    """Path of variants, without encoding extension, of file with
+    content hash `digest`, `target` is the path of the variant in cache
+    directory"""
+    return '{}.{}'.format(target, digest)
+
+
+def _remove_outdated(target, digest):
+    """Remove variants of `target` built from content other than
+    `digest`"""
+    dirname, basename = os.path.split(target)
+    prefix = basename + '.'
+    current = os.path.basename(_variant_base(target, digest)) + '.'
+    for name in os.listdir(dirname):
+        if name.startswith(prefix) and not name.startswith(current) and \
+           os.path.splitext(name)[1] in [ext for _, ext in ENCODINGS]:
+            _log.debug('removing outdated variant %s', name)
+            os.unlink(os.path.join(dirname, name))
+
+
+def _compress_file(path, target, use_brotli):
+    with open(path, 'rb') as inf:
+        data = inf.read()
+
+    digest = _content_hash(data)
+    base = _variant_base(target, digest)
+    _remove_outdated(target, digest)
+
+    if not os.path.exists(base + '.gz'):
+        _log.debug('compressing %s', path)
+        _gzip_compress(base + '.gz', data)
+
+    if use_brotli and not os.path.exists(base + '.br'):
+        with open(base + '.br', 'wb') as outf:
+            outf.write(_brotli_compress(data))
+
+
+def build_compressed(root, target):
+    """Build gzip, and brotli if brotli module is available, variants of
+    compressible files under `root` in directory `target`, keeping the
+    directory layout. Variants of current content of the original file
+    are kept, others are removed. Returns False if variants could not be built."""
+    try:
+        import brotli
+    except ImportError:
+        _log.debug('brotli not available, building gzip variants only')
+        use_brotli = False
+    else:
+        use_brotli = True
+
+    if not os.path.isdir(root):
+        return False
+
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if os.path.splitext(name)[1] not in COMPRESSIBLE:
+                continue
+            if os.path.getsize(path) < MIN_SIZE:
+                continue
+            variant = os.path.join(target, os.path.relpath(path, root))
+            try:
+                if not os.path.isdir(os.path.dirname(variant)):
+                    os.makedirs(os.path.dirname(variant))
+                _compress_file(path, variant, use_brotli)
+            except (IOError, OSError) as err:
+                # files will be served uncompressed
+                _log.warning('cannot build compressed variant of %s: %s',
+                             path, err)
+                return False
+    return True
+
+
+class StaticFileHandler(tornado.web.StaticFileHandler):
+    """Static file handler that serves precompressed variants of files
+    built by build_compressed() in `compressed_path`. Responses to
+    fingerprinted URLs are marked immutable."""
+
+    # absolute path -> (mtime, size, content hash) of original files
+    _content_hashes = {}
+
+    def initialize(self, path, default_filename=None, compressed_path=None):
+        super(StaticFileHandler, self).initialize(path, default_filename)
+        self.compressed_path = compressed_path
+        self.original_path = None
+        self.content_encoding = None
+
+    def validate_absolute_path(self, root, absolute_path):
+        absolute_path = super(StaticFileHandler, self).validate_absolute_path(
+            root, absolute_path)
+        if absolute_path is None:
+            return None
+
+        self.original_path = absolute_path
+        if not self.compressed_path:
+            return absolute_path
+
+        accepted = accepted_encodings(
+            self.request.headers.get('Accept-Encoding', ''),
+            [encoding for encoding, _ in ENCODINGS])
+        if not accepted or \
+           os.path.splitext(absolute_path)[1] not in COMPRESSIBLE:
+            return absolute_path
+
+        variant = os.path.join(self.compressed_path,
+                               os.path.relpath(absolute_path,
+                                               os.path.abspath(root)))
+        base = _variant_base(variant, self._get_content_hash(absolute_path))
+        for encoding, ext in ENCODINGS:
+            if encoding in accepted and os.path.exists(base + ext):
+                self.content_encoding = encoding
+                return base + ext
+        return absolute_path
+
+    @classmethod
+    def _get_content_hash(cls, path):
+        """Content hash of file at `path`, hashes are kept for the lifetime
+        of the process and recomputed if the file's size or modification
+        time changes"""
+        st = os.stat(path)
+        cached = cls._content_hashes.get(path)
+        if cached and cached[:2] == (st.st_mtime, st.st_size):
+            return cached[2]
+
+        with open(path, 'rb') as inf:
+            digest = _content_hash(inf.read())
+        cls._content_hashes[path] = (st.st_mtime, st.st_size, digest)
+        return digest
+
+    def get_content_type(self):
+        # content type of the original file, not of its variant
+        mime_type, encoding = mimetypes.guess_type(self.original_path)
+        if encoding == 'gzip':
+            return 'application/gzip'
+        elif encoding is not None:
+            return 'application/octet-stream'
+        elif mime_type is not None:
+            return mime_type
+        return 'application/octet-stream'
+
+    def set_extra_headers(self, path):
+        self.set_header('Vary', 'Accept-Encoding')
+        if self.content_encoding:
+            self.set_header('Content-Encoding', self.content_encoding)
+        if self.get_argument('v', None):
+            self.set_header('Cache-Control',
+                            'public, max-age=%d, immutable' % self.CACHE_MAX_AGE)
@@ -0,0 +1,241 @@
+#
+# Copyright (c) 2015 Open-RnD Sp. z o.o.
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Application metrics in Prometheus text format. Histograms have fixed
+buckets, observations only increment preallocated counters, hence
+recording and scraping stay cheap.
+
+Metrics are per process, with multiple workers each one reports its
+own."""
+
+from __future__ import absolute_import
+
+from ros3dui.system import trace
+from tornado.ioloop import IOLoop
+import bisect
+import logging
+import threading
+
+_log = logging.getLogger(__name__)
+
+# bucket upper bounds, in seconds
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CALL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                0.5, 1.0, 5.0)
+RELOAD_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\')
+            .replace('"', '\\"').replace('\n', '\\n'))
+
+
+def _format_labels(names, values, extra=None):
+    pairs = ['{}="{}"'.format(name, _escape(value))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(pairs) + '}'
+
+
+class _Histogram(object):
+    """Single histogram, bucket counts are not cumulative"""
+
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        # last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(object):
+    """Histogram metric with labels `labels`, a tuple of label names"""
+
+    TYPE = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=REQUEST_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        # label values -> _Histogram
+        self.children = {}
+
+    def observe(self, value, *label_values):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            child = self.children.get(label_values)
+            if child is None:
+                child = self.children[label_values] = _Histogram(self.buckets)
+            child.counts[idx] += 1
+            child.sum += value
+            child.count += 1
+
+    def render(self, out):
+        with self.lock:
+            children = [(values, list(child.counts), child.sum, child.count)
+                        for values, child in sorted(self.children.items())]
+
+        for values, counts, total, count in children:
+            cumulative = 0
+            bounds = [repr(bound) for bound in self.buckets] + ['+Inf']
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                out.append('{}_bucket{} {}'.format(
+                    self.name,
+                    _format_labels(self.labels, values, 'le="{}"'.format(bound)),
+                    cumulative))
+            labels = _format_labels(self.labels, values)
+            out.append('{}_sum{} {!r}'.format(self.name, labels, total))
+            out.append('{}_count{} {}'.format(self.name, labels, count))
+
+
+class Counter(object):
+    """Counter metric with labels `labels`"""
+
+    TYPE = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.lock = threading.Lock()
+        # label values -> count
+        self.children = {}
+
+    def inc(self, *label_values):
+        with self.lock:
+            self.children[label_values] = self.children.get(label_values, 0) + 1
+
+    def render(self, out):
+        with self.lock:
+            children = sorted(self.children.items())
+        for values, count in children:
+            out.append('{}{} {}'.format(
+                self.name, _format_labels(self.labels, values), count))
+
+
+class Metrics(object):
+    """Metrics of the web UI. Requests are recorded by Application, D-Bus
+    calls, REST requests and service reloads through trace observer
+    registered in `start()`. D-Bus calls are recorded if made through
+    trace.TracedInterface proxies, or asynchronously with
+    asyncbus.call_async(), calls on plain dbus proxies are not."""
+
+    LAG_INTERVAL = 1.0
+
+    def __init__(self):
+        self.requests = Histogram(
+            'ros3dui_http_request_duration_seconds',
+            'HTTP request duration per handler', ('handler',))
+        self.responses = Counter(
+            'ros3dui_http_responses_total',
+            'HTTP responses per handler and status code', ('handler', 'code'))
+        self.dbus_calls = Histogram(
+            'ros3dui_dbus_call_duration_seconds',
+            'D-Bus method call duration per interface', ('interface',),
+            CALL_BUCKETS)
+        self.dbus_errors = Counter(
+            'ros3dui_dbus_call_errors_total',
+            'Failed D-Bus method calls per interface', ('interface',))
+        self.rest_requests = Histogram(
+            'ros3dui_rest_request_duration_seconds',
+            'Device controller REST request duration per endpoint',
+            ('endpoint',), CALL_BUCKETS)
+        self.rest_errors = Counter(
+            'ros3dui_rest_request_errors_total',
+            'Failed device controller REST requests per endpoint',
+            ('endpoint',))
+        self.reloads = Histogram(
+            'ros3dui_service_reload_duration_seconds',
+            'Duration of service reload helper runs', (), RELOAD_BUCKETS)
+        self.reload_failures = Counter(
+            'ros3dui_service_reload_failures_total',
+            'Failed service reload helper runs')
+        self.ioloop_lag = Histogram(
+            'ros3dui_ioloop_lag_seconds',
+            'Delay of IOLoop callbacks past their scheduled time', (),
+            LAG_BUCKETS)
+
+        self.all = [self.requests, self.responses, self.dbus_calls,
+                    self.dbus_errors, self.rest_requests, self.rest_errors,
+                    self.reloads, self.reload_failures, self.ioloop_lag]
+        self.io_loop = None
+        self.expected = None
+        self.lag_timeout = None
+
+    def observe_request(self, handler_name, status, duration):
+        self.requests.observe(duration, handler_name)
+        self.responses.inc(handler_name, status)
+
+    def _on_operation(self, category, name, duration, error):
+        if category == trace.DBUS:
+            self.dbus_calls.observe(duration, name)
+            if error:
+                self.dbus_errors.inc(name)
+        elif category == trace.REST:
+            self.rest_requests.observe(duration, name)
+            if error:
+                self.rest_errors.inc(name)
+        elif category == trace.SUBPROCESS:
+            self.reloads.observe(duration)
+            if error:
+                self.reload_failures.inc()
+
+    def start(self):
+        """Start recording traced operations and measuring IOLoop lag, call
+        from IOLoop thread"""
+        trace.add_observer(self._on_operation)
+        self.io_loop = IOLoop.current()
+        self._schedule_lag_check()
+
+    def stop(self):
+        """Stop recording, call from IOLoop thread"""
+        trace.remove_observer(self._on_operation)
+        if self.lag_timeout is not None:
+            self.io_loop.remove_timeout(self.lag_timeout)
+            self.lag_timeout = None
+
+    def _schedule_lag_check(self):
+        self.expected = self.io_loop.time() + self.LAG_INTERVAL
+        self.lag_timeout = self.io_loop.call_later(self.LAG_INTERVAL,
+                                                   self._check_lag)
+
+    def _check_lag(self):
+        self.ioloop_lag.observe(max(0.0, self.io_loop.time() - self.expected))
+        self._schedule_lag_check()
+
+    def render(self):
+        """Render all metrics in text exposition format"""
+        out = []
+        for metric in self.all:
+            out.append('# HELP {} {}'.format(metric.name, metric.description))
+            out.append('# TYPE {} {}'.format(metric.name, metric.TYPE))
+            metric.render(out)
+        out.append('')
+        return '\n'.join(out)
@@ -0,0 +1,117 @@
+#
+# Copyright (c) 2015 Open-RnD Sp. z o.o.
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Render-on-change page cache. A page is rendered only when its input
+state differs from the one it was last rendered with, or when its
+template was reloaded. Rendered pages are held as ready bytes, along
+with a gzip compressed variant and an ETag of each."""
+
+from __future__ import absolute_import
+
+from ros3dui.web.assets import accepted_encodings
+from tornado.escape import utf8
+import gzip
+import hashlib
+import io
+import json
+import logging
+
+_log = logging.getLogger(__name__)
+
+
+def _state_key(state):
+    return hashlib.sha1(utf8(json.dumps(state, sort_keys=True))).hexdigest()
+
+
+def _gzip(data):
+    buf = io.BytesIO()
+    with gzip.GzipFile(mode='wb', fileobj=buf, compresslevel=9, mtime=0) as out:
+        out.write(data)
+    return buf.getvalue()
+
+
+class RenderedPage(object):
+    """Rendered page body, its gzip variant and their ETags"""
+
+    def __init__(self, state_key, template, body):
+        self.state_key = state_key
+        self.template = template
+        self.body = body
+        self.gzipped = _gzip(body)
+        digest = hashlib.sha1(body).hexdigest()
+        self.etag = '"%s"' % digest
+        self.gzipped_etag = '"%s-gzip"' % digest
+
+
+class PageCache(object):
+    """Cache of rendered pages, keyed by template name and page
+    variant"""
+
+    def __init__(self, loader):
+        self.loader = loader
+        # (name, variant) -> RenderedPage
+        self.pages = {}
+
+    def get(self, name, state, render, variant=None):
+        """Get page `name` for given `state`. `state` must be JSON
+        serializable, `render` is called with the template to render
+        the page when state has changed. `variant` distinguishes
+        versions of the same page, eg. with a banner shown."""
+        tmpl = self.loader.load(name)
+        state_key = _state_key(state)
+
+        key = (name, variant)
+        page = self.pages.get(key)
+        if page and page.state_key == state_key and page.template is tmpl:
+            return page
+
+        _log.debug('rendering page %s, variant %r', name, variant)
+        page = RenderedPage(state_key, tmpl, utf8(render(tmpl)))
+        self.pages[key] = page
+        return page
+
+
+def write_page(handler, page):
+    """Write rendered `page` as a response of request `handler`. Sends the
+    gzip variant if the client accepts it, replies with 304 if the
+    client has a current copy of the variant. The gzip variant is never
+    sent with `trace_footer` setting, so that the footer can be
+    appended."""
+    gzipped = (not handler.settings.get('trace_footer') and
+               accepted_encodings(
+                   handler.request.headers.get('Accept-Encoding', ''),
+                   ['gzip']))
+
+    handler.set_header('Content-Type', 'text/html; charset=UTF-8')
+    handler.set_header('Cache-Control', 'no-cache')
+    handler.set_header('Vary', 'Accept-Encoding')
+    handler.set_header('Etag', page.gzipped_etag if gzipped else page.etag)
+
+    if handler.check_etag_header():
+        handler.set_status(304)
+        return
+
+    if gzipped:
+        handler.set_header('Content-Encoding', 'gzip')
+        handler.write(page.gzipped)
+    else:
+        handler.write(page.body)
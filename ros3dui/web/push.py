@@ -0,0 +1,141 @@
+#
+# Copyright (c) 2015 Open-RnD Sp. z o.o.
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Push of status changes to open status pages. A single publisher
+collects status data periodically, as long as there is at least one
+subscriber, and sends changed values to all subscribers."""
+
+from __future__ import absolute_import
+
+from ros3dui.web.status import StatusCollector
+from ros3dui.system import trace
+from tornado.ioloop import PeriodicCallback
+from tornado.stack_context import NullContext
+from tornado import gen
+import logging
+import re
+
+_log = logging.getLogger(__name__)
+
+
+def cell_id(group, name):
+    """Build HTML element ID of status value cell of entry `name` in
+    `group`"""
+    return 'status-' + re.sub(r'[^a-z0-9]+', '-',
+                              '{}-{}'.format(group, name).lower()).strip('-')
+
+
+def status_cells(status):
+    """Flatten status data returned by StatusCollector.collect() to a
+    dict of cell ID -> value"""
+    cells = {}
+    for entry in status[StatusCollector.SOURCE_SYSTEM]:
+        cells[cell_id(StatusCollector.SOURCE_SYSTEM, entry['name'])] = entry['value']
+
+    for source in [StatusCollector.SOURCE_NETWORK,
+                   StatusCollector.SOURCE_CAMERAS]:
+        for group, entries in status[source].items():
+            for entry in entries:
+                cells[cell_id(group, entry['name'])] = entry['value']
+    return cells
+
+
+class StatusPublisher(object):
+    """Collects status data every `interval` seconds while there are
+    subscribers. Subscribers are callables, called with a dict of
+    changed cells (cell ID -> value, None for cells that are gone). A
+    new subscriber first gets all cells of last known state."""
+
+    INTERVAL = 2.0
+
+    def __init__(self, collector, interval=INTERVAL):
+        self.collector = collector
+        self.interval = interval
+        self.subscribers = set()
+        # last published cells
+        self.cells = None
+        self.timer = None
+        self.collecting = False
+
+    def subscribe(self, subscriber):
+        self.subscribers.add(subscriber)
+        _log.debug('subscribers: %d', len(self.subscribers))
+
+        if self.cells is not None:
+            subscriber(dict(self.cells))
+
+        if self.timer is None:
+            _log.debug('starting status publisher')
+            # collection is shared by all subscribers, do not carry
+            # the context and trace of the first one's request over
+            with NullContext(), trace.activate(None):
+                self.timer = PeriodicCallback(self._collect,
+                                              self.interval * 1000)
+                self.timer.start()
+                self._collect()
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+        _log.debug('subscribers: %d', len(self.subscribers))
+
+        if not self.subscribers and self.timer is not None:
+            _log.debug('stopping status publisher')
+            self.timer.stop()
+            self.timer = None
+            # state goes stale while nobody is watching
+            self.cells = None
+
+    @gen.coroutine
+    def _collect(self):
+        if self.collecting:
+            # previous collection still in progress
+            return
+
+        self.collecting = True
+        try:
+            status = yield self.collector.collect()
+        finally:
+            self.collecting = False
+
+        cells = status_cells(status)
+        if self.cells is None:
+            changed = cells
+        else:
+            changed = dict((cid, value) for cid, value in cells.items()
+                           if self.cells.get(cid) != value)
+            changed.update((cid, None) for cid in self.cells
+                           if cid not in cells)
+        if not self.subscribers:
+            return
+        self.cells = cells
+
+        if changed:
+            _log.debug('publish %d changed cells', len(changed))
+            self.publish(changed)
+
+    def publish(self, changed):
+        for subscriber in list(self.subscribers):
+            try:
+                subscriber(dict(changed))
+            except Exception:
+                _log.exception('failed to publish to subscriber')
+                self.unsubscribe(subscriber)
@@ -0,0 +1,103 @@
+#
+# Copyright (c) 2015 Open-RnD Sp. z o.o.
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Detection of IOLoop stalls. A callback running longer than the
+threshold is interrupted by SIGALRM (see
+IOLoop.set_blocking_signal_threshold()), its stack and the URL of the
+request being handled are logged and kept in a bounded ring. Signal
+handlers run between Python bytecodes, a stall inside a C call (ex. a
+blocking D-Bus call) is reported once the call returns, with the stack
+pointing at the caller. The signal handler only captures the stack,
+the stall is recorded and logged from the IOLoop once the blocking
+callback returns.
+
+Works only with IOLoop running in the main thread."""
+
+from __future__ import absolute_import
+
+from ros3dui.system import trace
+from tornado.ioloop import IOLoop
+from collections import deque
+import linecache
+import logging
+import signal
+import threading
+import time
+import traceback
+
+_log = logging.getLogger(__name__)
+
+
+class StallDetector(object):
+    """Records IOLoop callbacks blocking for more than `threshold`
+    seconds, last `size` stalls are kept"""
+
+    RING_SIZE = 32
+
+    def __init__(self, threshold, size=RING_SIZE):
+        self.threshold = threshold
+        self.stalls = deque(maxlen=size)
+        # number of stalls since start
+        self.count = 0
+        self.io_loop = None
+
+    def start(self, io_loop=None):
+        """Start watching `io_loop`, or current IOLoop, must be called from
+        main thread"""
+        if threading.current_thread().name != 'MainThread':
+            raise RuntimeError('stall detector needs IOLoop in main thread')
+
+        self.io_loop = io_loop or IOLoop.current()
+        self.io_loop.set_blocking_signal_threshold(self.threshold,
+                                                   self._on_blocked)
+        # restart system calls interrupted by the alarm, rather than
+        # failing them with EINTR
+        signal.siginterrupt(signal.SIGALRM, False)
+        _log.info('IOLoop stall threshold: %.3f s', self.threshold)
+
+    def _on_blocked(self, signum, frame):
+        # runs in signal handler, only collect the stack
+        request_trace = trace.current()
+        url = request_trace.url if request_trace else None
+        frames = []
+        while frame is not None:
+            frames.append((frame.f_code.co_filename, frame.f_lineno,
+                           frame.f_code.co_name))
+            frame = frame.f_back
+        self.io_loop.add_callback_from_signal(self._record, time.time(),
+                                              url, frames)
+
+    def _record(self, when, url, frames):
+        entries = [(filename, lineno, name,
+                    linecache.getline(filename, lineno).strip() or None)
+                   for filename, lineno, name in reversed(frames)]
+        stack = ''.join(traceback.format_list(entries))
+
+        self.count += 1
+        self.stalls.append(dict(time=when, url=url, stack=stack))
+        _log.warning('IOLoop blocked for more than %.3f s, request: %s\n%s',
+                     self.threshold, url, stack)
+
+    def get_stalls(self):
+        """Get a list of recorded stalls, oldest first, each a dict with
+        keys time, url and stack"""
+        return list(self.stalls)
@@ -0,0 +1,439 @@
+#
+# Copyright (c) 2015 Open-RnD Sp. z o.o.
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Collection of data presented on status page"""
+
+from __future__ import absolute_import
+from ros3dui.system.network import network_provider, DETAIL_STATUS
+from ros3dui.system.camera import get_camera_manager, CameraManagerError
+from ros3dui.system.util import ConfigLoader, get_hostname, write_state
+from ros3dui.system.asyncbus import run_blocking
+from tornado import gen
+from tornado.ioloop import IOLoop, PeriodicCallback
+from datetime import timedelta
+import json
+import logging
+import os
+import time
+
+_log = logging.getLogger(__name__)
+
+ALADIN_MODES = {'READ_ONLY':'Read only',
+                'INTERACTIVE':'Interactive'}
+
+UNAVAILABLE_TIMED_OUT = 'unavailable (timed out)'
+UNAVAILABLE_ERROR = 'unavailable (error)'
+
+UPTIME_ENTRY = 'Uptime'
+
+CONTROLLER_UNAVAILABLE = 'Controller service unavailable'
+
+
+def get_uptime_seconds():
+    """Get system uptime in seconds"""
+    with open('/proc/uptime') as inf:
+        return float(inf.read().strip().split()[0])
+
+
+def format_uptime(secs):
+    """Format uptime given in seconds for presentation"""
+    days, rest = divmod(int(secs), 3600 * 24)
+    hours, rest = divmod(rest, 3600)
+    minutes, rest = divmod(rest, 60)
+    seconds = rest
+
+    uptime = '{}d {}h {}m {}s'.format(days, hours,
+                                      minutes, seconds)
+    _log.debug('system uptime: %s', str(uptime))
+    return str(uptime)
+
+
+def get_uptime():
+    """Get system uptime formatted for presentation"""
+    return format_uptime(get_uptime_seconds())
+
+
+def get_boot_time():
+    """Get system boot time as seconds since epoch"""
+    with open('/proc/stat') as inf:
+        for line in inf:
+            if line.startswith('btime '):
+                return int(line.split()[1])
+    return None
+
+
+def list_interfaces(detail=DETAIL_STATUS):
+    """List interfaces of process wide network provider at given detail
+    level, for use in worker threads"""
+    return network_provider().list_interfaces(detail)
+
+
+def _interface_data(idata):
+    """Status of interface described by provider's interface data
+    `idata`"""
+    iface = dict(device=idata['device'], mac=idata['mac'],
+                 online=bool(idata['online']), ipv4=None)
+
+    ipv4 = idata.get('ipv4', None)
+    if ipv4:
+        iface['ipv4'] = dict(address=ipv4['address'],
+                             netmask=ipv4['netmask'],
+                             gateway=ipv4.get('gateway', None),
+                             method=ipv4['method'])
+
+    if idata['type'] == 'wireless':
+        iface['access_point'] = idata.get('name') if idata['online'] else None
+        iface['strength'] = idata.get('strength', None)
+        iface['bitrate'] = idata.get('bitrate', None)
+    return iface
+
+
+class StatusCollector(object):
+    """Collects status page data from system, network and camera
+    sources. Sources are queried concurrently, each with its own
+    deadline (in seconds). A source that fails or misses the deadline
+    is presented as unavailable, the remaining ones are not held back.
+
+    collect_data() provides status as plain data, a dict for each
+    source:
+    - system - hostname, rig, aladin (control mode, None unless
+      running on Image Analyser), boot_time (seconds since epoch),
+      uptime (seconds)
+    - network - interface type (wired/wireless) -> list of interfaces,
+      each with device, mac, online, ipv4 (address, netmask, gateway,
+      method or None) and for wireless access_point, strength, bitrate
+    - cameras - cameras, list of cameras with id and state
+    Data of unavailable source is a dict with reason under `error`.
+    collect() presents the data as status page entries.
+
+    Timed out queries keep running in background. Network status is
+    queried by at most one worker thread at a time, concurrent
+    collections share the query in flight, so that a hung backend does
+    not exhaust the worker pool. System data is cheap to obtain and is
+    read in the IOLoop thread.
+    """
+
+    SOURCE_SYSTEM = 'system'
+    SOURCE_NETWORK = 'network'
+    SOURCE_CAMERAS = 'cameras'
+
+    DEADLINES = {
+        SOURCE_SYSTEM: 1.0,
+        SOURCE_NETWORK: 3.0,
+        SOURCE_CAMERAS: 3.0,
+    }
+
+    def __init__(self, app, deadlines=None):
+        self.app = app
+        self.deadlines = dict(self.DEADLINES)
+        if deadlines:
+            self.deadlines.update(deadlines)
+        # network query in flight, a future
+        self.net_pending = None
+
+    @gen.coroutine
+    def _sys(self):
+        # configuration is a cached snapshot, the rest comes from /proc
+        # and /etc
+        config = ConfigLoader.snapshot()
+        data = dict(hostname=get_hostname(),
+                    rig=config.get_system() or None,
+                    aladin=None,
+                    boot_time=get_boot_time(),
+                    uptime=get_uptime_seconds())
+
+        if self.app.mode == self.app.MODE_KR:
+            data['aladin'] = config.get_aladin()
+        raise gen.Return(data)
+
+    def _system_entries(self, data):
+        hostname = data['hostname']
+        if not hostname:
+            hostname = 'ros3d'
+
+        rig = data['rig']
+        if not rig:
+            rig = 'None'
+
+        system_entries= [
+            dict(name='Hostname', value=hostname),
+            dict(name='Assigned Rig', value=rig)
+        ]
+
+        if data['aladin'] is not None:
+            system_entries.append(dict(name='Aladin Control Mode',
+                                       value=ALADIN_MODES[data['aladin']]))
+
+        system_entries.append(dict(name=UPTIME_ENTRY,
+                                   value=format_uptime(data['uptime'])))
+        return system_entries
+
+    def _list_interfaces(self):
+        """Query network status in a worker thread, returns a future shared
+        with other callers until the query completes"""
+        if self.net_pending is None:
+            def _done(future):
+                self.net_pending = None
+
+            self.net_pending = run_blocking(list_interfaces)
+            IOLoop.current().add_future(self.net_pending, _done)
+        return self.net_pending
+
+    @gen.coroutine
+    def _net(self):
+        data = yield self._list_interfaces()
+
+        # we're intersted in wired and wireless interfaces only
+        itypes = ['wired']
+        if self.app.mode == self.app.MODE_KR:
+            itypes.append('wireless')
+
+        network = dict((itype, [_interface_data(idata)
+                                for idata in data.get(itype, [])])
+                       for itype in itypes)
+        raise gen.Return(network)
+
+    def _net_entries(self, network):
+        network_entries = {}
+        for itype, ifaces in network.items():
+            entry = network_entries[itype] = []
+            if not ifaces:
+                # device status is present in interface data, assuming
+                # that there should be one add a status info that
+                # there is 'no device' at this time
+                entry.append(dict(name='State', value='No device'))
+                _log.debug('interface type %s not in available interfaces',
+                           itype)
+                continue
+
+            # expecting only one interface
+            if len(ifaces) > 1:
+                _log.error('more than 1 interface of type %s', itype)
+
+            iface = ifaces[0]
+            _log.debug('interface data: %s', iface)
+
+            ipv4 = iface['ipv4']
+            # first interface name
+            entry.append(dict(name='Interface', value=iface['device']))
+            # MAC address comes next
+            entry.append(dict(name='MAC Address', value=iface['mac']))
+            # interface status
+            if iface['online']:
+                entry.append(dict(name='State', value='Up'))
+
+                # add connected access point entry, signal strength (in
+                # percent) and bitrate (in kbit/s) if provided
+                if itype == 'wireless':
+                    entry.append(dict(name='Access Point',
+                                      value=iface['access_point']))
+                    if iface['strength'] is not None:
+                        entry.append(dict(name='Signal Strength',
+                                          value='{}%'.format(iface['strength'])))
+                    if iface['bitrate'] is not None:
+                        entry.append(dict(name='Bitrate',
+                                          value='{:g} Mbit/s'.format(
+                                              iface['bitrate'] / 1000.0)))
+            else:
+                # may not be online but still usable with local addressing
+                if ipv4 and ipv4['address'].startswith('169.254'):
+                    entry.append(dict(name='State', value='Up/Local'))
+                else:
+                    entry.append(dict(name='State', value='Down'))
+
+            # now fill IPv4 status
+            if ipv4:
+                # address first
+                entry.append(dict(name='IPv4 Address', value=ipv4['address']))
+                # network mask
+                entry.append(dict(name='IPv4 Mask', value=ipv4['netmask']))
+                # gateway
+                entry.append(dict(name='IPv4 Gateway', value=ipv4['gateway'] or 'Not set'))
+                # IP address source, this can be either DHCP, static,
+                # or auto link-local. The connman provider returns
+                # DHCP when link-local address was configured
+                if ipv4['method'] == 'dhcp':
+                    method = 'DHCP'
+                    # override address source for link local addresses
+                    if ipv4['address'].startswith('169.254'):
+                        _log.debug('IP %s like link local address', ipv4['address'])
+                        method = 'Link Local'
+                else:
+                    method = 'Static'
+                entry.append(dict(name='Address Source', value=method))
+
+        _log.debug('network entries: %s', network_entries)
+        return network_entries
+
+    @gen.coroutine
+    def _cam(self):
+        try:
+            camera_data = yield get_camera_manager().get_details_async()
+        except CameraManagerError:
+            raise gen.Return(dict(error=CONTROLLER_UNAVAILABLE))
+
+        cameras = [dict(id=camera['name'], state=camera['value'])
+                   for camera in camera_data]
+        raise gen.Return(dict(cameras=cameras))
+
+    def _cam_entries(self, data):
+        entries = {}
+        if not data['cameras']:
+            entries['Warning'] = [dict(name='No cameras found', value='')]
+        else:
+            for idx, camera in enumerate(data['cameras']):
+                name = 'Camera ' + str(idx+1)
+                entries[name] = [dict(name=camera['id'],
+                                      value=camera['state'])]
+        return entries
+
+    def _unavailable(self, source, reason):
+        """Entries presented in place of source data"""
+        if source == self.SOURCE_SYSTEM:
+            return [dict(name='System', value=reason)]
+        elif source == self.SOURCE_NETWORK:
+            entries = {'wired': [dict(name='State', value=reason)]}
+            if self.app.mode == self.app.MODE_KR:
+                entries['wireless'] = [dict(name='State', value=reason)]
+            return entries
+        elif reason == CONTROLLER_UNAVAILABLE:
+            return {'Error': [dict(name=reason, value='')]}
+        return {'Error': [dict(name='Camera controller', value=reason)]}
+
+    def _entries(self, source, data):
+        """Present `data` of `source` as status page entries"""
+        if 'error' in data:
+            return self._unavailable(source, data['error'])
+
+        formatters = {
+            self.SOURCE_SYSTEM: self._system_entries,
+            self.SOURCE_NETWORK: self._net_entries,
+            self.SOURCE_CAMERAS: self._cam_entries,
+        }
+        return formatters[source](data)
+
+    @gen.coroutine
+    def _with_deadline(self, source, future):
+        deadline = timedelta(seconds=self.deadlines[source])
+        try:
+            result = yield gen.with_timeout(deadline, future)
+        except gen.TimeoutError:
+            _log.warning('source %s timed out', source)
+            result = dict(error=UNAVAILABLE_TIMED_OUT)
+        except Exception:
+            _log.exception('source %s failed', source)
+            result = dict(error=UNAVAILABLE_ERROR)
+        raise gen.Return(result)
+
+    @gen.coroutine
+    def collect_data(self, sources=None):
+        """Collect status data. Returns a dict of source name -> source
+        data. Pass a list of source names in `sources` to collect only
+        these."""
+        collectors = {
+            self.SOURCE_SYSTEM: self._sys,
+            self.SOURCE_NETWORK: self._net,
+            self.SOURCE_CAMERAS: self._cam,
+        }
+        if sources is None:
+            sources = collectors.keys()
+        results = yield dict((source,
+                              self._with_deadline(source, collectors[source]()))
+                             for source in sources)
+        raise gen.Return(results)
+
+    @gen.coroutine
+    def collect(self, sources=None):
+        """Collect status page entries. Returns a dict with keys system
+        (list of entries), network and cameras (dicts of entries
+        lists). Pass a list of source names in `sources` to collect only
+        these."""
+        data = yield self.collect_data(sources)
+        raise gen.Return(dict((source, self._entries(source, source_data))
+                              for source, source_data in data.items()))
+
+
+class SharedStatusCollector(StatusCollector):
+    """Status collector shared by worker processes. Only the writer
+    collects status data, every INTERVAL seconds, and stores it in a
+    state file at `state_path`, which must be in a private directory,
+    see `prepare_state_dir()`. Other workers read the state file. If
+    the state is older than STALE_AFTER seconds, status is collected
+    locally."""
+
+    INTERVAL = 2.0
+    STALE_AFTER = 10.0
+
+    def __init__(self, app, state_path, writer, deadlines=None):
+        super(SharedStatusCollector, self).__init__(app, deadlines)
+        self.state_path = state_path
+        self.writer = writer
+        self.timer = None
+        # last state read or written, (mtime, status)
+        self.state = (None, None)
+
+    def start(self):
+        """Start collecting, no-op unless writer"""
+        if not self.writer:
+            return
+        self.timer = PeriodicCallback(self._publish, self.INTERVAL * 1000)
+        self.timer.start()
+        self._publish()
+
+    @gen.coroutine
+    def _publish(self):
+        status = yield super(SharedStatusCollector, self).collect_data()
+
+        try:
+            write_state(self.state_path, status)
+        except (IOError, OSError):
+            _log.exception('failed to write state file %s', self.state_path)
+        self.state = (time.time(), status)
+
+    def _read(self):
+        if self.writer:
+            return self.state
+
+        try:
+            mtime = os.path.getmtime(self.state_path)
+        except OSError:
+            return None, None
+
+        if mtime != self.state[0]:
+            try:
+                with open(self.state_path) as inf:
+                    self.state = (mtime, json.load(inf))
+            except (IOError, ValueError):
+                _log.exception('failed to read state file %s', self.state_path)
+                return None, None
+        return self.state
+
+    @gen.coroutine
+    def collect_data(self, sources=None):
+        updated, status = self._read()
+        if status is None or time.time() - updated > self.STALE_AFTER:
+            _log.warning('shared status not available, collecting locally')
+            status = yield super(SharedStatusCollector, self).collect_data(sources)
+
+        if sources is not None:
+            status = dict((source, status[source]) for source in sources)
+        raise gen.Return(status)
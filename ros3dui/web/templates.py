@@ -0,0 +1,107 @@
+#
+# Copyright (c) 2015 Open-RnD Sp. z o.o.
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from __future__ import absolute_import
+from ros3dui.system import trace
+import tornado.template
+import logging
+import os.path
+import os
+
+_log = logging.getLogger(__name__)
+
+
+def _traced_generate(generate, name):
+    def _generate(**kwargs):
+        with trace.timed(trace.TEMPLATE, name):
+            return generate(**kwargs)
+    return _generate
+
+
+class TemplateLoader(tornado.template.Loader):
+    """Template loader shared by all request handlers. Compiled templates
+    are kept for the lifetime of the application. If `check_mtime` is
+    set, modification times of template files are checked whenever a
+    template is requested by a handler and the whole cache is dropped
+    if any of the files changed. Templates that extend or include other
+    templates have them compiled in, hence the whole cache needs to go.
+    """
+
+    def __init__(self, root_directory, check_mtime=True, **kwargs):
+        super(TemplateLoader, self).__init__(root_directory, **kwargs)
+        self.check_mtime = check_mtime
+        # template name -> modification time at the time of compilation
+        self.mtimes = {}
+
+    def _changed(self):
+        """Return True if any of the compiled templates was modified"""
+        for name, mtime in self.mtimes.items():
+            try:
+                current = os.path.getmtime(os.path.join(self.root, name))
+            except OSError:
+                current = None
+            if current != mtime:
+                _log.debug('template %s changed', name)
+                return True
+        return False
+
+    def reset(self):
+        with self.lock:
+            super(TemplateLoader, self).reset()
+            self.mtimes = {}
+
+    def load(self, name, parent_path=None):
+        # templates loaded from within other templates (extends,
+        # include) have a parent path, check only when a handler
+        # asks for a template
+        if self.check_mtime and not parent_path:
+            with self.lock:
+                if self._changed():
+                    _log.info('templates changed, dropping compiled templates')
+                    self.reset()
+        return super(TemplateLoader, self).load(name, parent_path)
+
+    def _create_template(self, name):
+        path = os.path.join(self.root, name)
+        # stat before compiling so that a change made meanwhile is
+        # noticed, missing templates raise IOError like in base Loader
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError as err:
+            raise IOError(err.errno, err.strerror, path)
+        _log.debug('compiling template %s', name)
+        template = super(TemplateLoader, self)._create_template(name)
+        self.mtimes[name] = mtime
+        template.generate = _traced_generate(template.generate, name)
+        return template
+
+    def precompile(self):
+        """Compile all templates found in root directory"""
+        for fname in sorted(os.listdir(self.root)):
+            if not fname.endswith('.html'):
+                continue
+            _log.debug('precompiling template %s', fname)
+            try:
+                self.load(fname)
+            except Exception:
+                _log.exception('failed to compile template %s', fname)
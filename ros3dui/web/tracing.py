@@ -0,0 +1,108 @@
+#
+# Copyright (c) 2015 Open-RnD Sp. z o.o.
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Per-request tracing of handlers. Counts and durations of operations
+recorded with ros3dui.system.trace are sent in Server-Timing response
+header, and with `trace_footer` application setting, appended to HTML
+pages."""
+
+from __future__ import absolute_import
+
+from ros3dui.system import trace
+from tornado.stack_context import StackContext
+import tornado.web
+import functools
+import re
+import time
+
+_SERVER_TIMING_RE = re.compile(r'(\w+);desc="(\d+) calls";dur=([0-9.]+)')
+
+
+def server_timing(request_trace):
+    """Format Server-Timing header value of `request_trace`"""
+    metrics = ['{};desc="{} calls";dur={:.1f}'.format(
+        category, request_trace.counts[category],
+        request_trace.durations[category] * 1000.0)
+               for category in trace.CATEGORIES]
+    metrics.append('total;dur={:.1f}'.format(
+        (time.time() - request_trace.started) * 1000.0))
+    return ', '.join(metrics)
+
+
+def parse_server_timing(value):
+    """Parse Server-Timing header value produced by server_timing(),
+    returns a dict of category -> count. Can be passed to
+    trace.check_budget(), ex:
+
+      counts = parse_server_timing(response.headers['Server-Timing'])
+      trace.check_budget(counts, dbus=10)
+    """
+    return dict((category, int(count))
+                for category, count, _ in _SERVER_TIMING_RE.findall(value))
+
+
+def _footer(request_trace):
+    items = ', '.join('{} {} calls, {:.1f} ms'.format(
+        category, request_trace.counts[category],
+        request_trace.durations[category] * 1000.0)
+                      for category in trace.CATEGORIES)
+    return ('<div class="container trace-footer"><small>{}</small></div>'
+            .format(items))
+
+
+class TracedRequestHandler(tornado.web.RequestHandler):
+    """Request handler with operations made while handling the request
+    traced"""
+
+    trace = None
+
+    def prepare(self):
+        self.trace = trace.Trace(self.request.uri)
+        # HTTP method handler is looked up after prepare(), run it with
+        # the trace active, the trace then follows request's callbacks
+        name = self.request.method.lower()
+        setattr(self, name, self._traced(getattr(self, name)))
+
+    def _traced(self, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            with StackContext(functools.partial(trace.activate, self.trace)):
+                return method(*args, **kwargs)
+        return wrapper
+
+    def flush(self, include_footers=False, callback=None):
+        if not self._headers_written and self.trace:
+            self.set_header('Server-Timing', server_timing(self.trace))
+        return super(TracedRequestHandler, self).flush(include_footers,
+                                                       callback)
+
+    def finish(self, chunk=None):
+        if chunk is not None:
+            self.write(chunk)
+        # pages are not compressed when trace footer is enabled, see
+        # pages.write_page()
+        if (self.settings.get('trace_footer') and self.trace and
+                not self._headers_written and self.get_status() == 200 and
+                'Content-Encoding' not in self._headers and
+                self._headers.get('Content-Type', '').startswith('text/html')):
+            self.write(_footer(self.trace))
+        return super(TracedRequestHandler, self).finish()
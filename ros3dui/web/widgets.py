@@ -0,0 +1,143 @@
+#
+# Copyright (c) 2015 Open-RnD Sp. z o.o.
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from __future__ import absolute_import
+from ros3dui.system import trace
+import tornado.template
+import logging
+
+_log = logging.getLogger(__name__)
+
+
+# a template rendering a list of widgets in one pass, widgets.html is
+# compiled in, output of each widget is passed to `collect` rather than
+# concatenated
+_BATCH_TEMPLATE = ('{% for entry in entries %}'
+                   '{% apply collect %}'
+                   '{% include "widgets.html" %}'
+                   '{% end %}'
+                   '{% end %}')
+
+
+def _entry_key(entry):
+    """Build a hashable key from widget description or return None if
+    the entry cannot be cached"""
+    try:
+        key = tuple(sorted((k, tuple(v) if isinstance(v, list) else v)
+                           for k, v in entry.items()))
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+class WidgetRenderer(object):
+    """Render form widgets using `widgets.html` template. Widget
+    description is a dict with fields:
+    - id - used as field id/name
+    - value - field value or None
+    - type - dropdown/input/password/plain etc.
+
+    Dropdown widgets will produce a dropbox. Input/password produce a
+    one line text input (password uses masking characters). Plain,
+    outputs entry's value as it is.
+
+    Widgets not found in fragment cache are rendered together in a
+    single template generation. Rendered fragments are cached by entry
+    content, the cache is dropped once it grows over `cache_size`
+    entries or widget template changes.
+    """
+
+    WIDGET_TEMPLATE = 'widgets.html'
+
+    def __init__(self, loader, cache_size=256):
+        self.loader = loader
+        self.cache_size = cache_size
+        self.fragments = {}
+        self._widget_tmpl = None
+        self._batch_tmpl = None
+
+    def _get_batch_template(self):
+        """Get a compiled batch template, recompiling it and dropping
+        fragments cache if widget template was reloaded"""
+        widget_tmpl = self.loader.load(self.WIDGET_TEMPLATE)
+        if widget_tmpl is not self._widget_tmpl:
+            _log.debug('compiling batch widget template')
+            self._batch_tmpl = tornado.template.Template(
+                _BATCH_TEMPLATE, name='<widgets-batch>.html',
+                loader=self.loader)
+            self._widget_tmpl = widget_tmpl
+            self.fragments = {}
+        return self._batch_tmpl
+
+    def render(self, entries):
+        """Render widgets for all `entries`, returns a list of fragments in
+        the same order"""
+        tmpl = self._get_batch_template()
+
+        if len(self.fragments) > self.cache_size:
+            _log.debug('dropping widget fragments cache')
+            self.fragments = {}
+
+        keys = [_entry_key(entry) for entry in entries]
+        cached = [key is not None and key in self.fragments for key in keys]
+        missing = [entry for entry, hit in zip(entries, cached) if not hit]
+
+        rendered = []
+        if missing:
+            _log.debug('render %d of %d widgets', len(missing), len(entries))
+
+            def collect(fragment):
+                rendered.append(fragment)
+                return ''
+
+            with trace.timed(trace.TEMPLATE, 'widgets.html'):
+                tmpl.generate(entries=missing, collect=collect)
+            assert len(rendered) == len(missing)
+
+        fragments = []
+        rendered = iter(rendered)
+        for key, hit in zip(keys, cached):
+            if hit:
+                fragment = self.fragments[key]
+            else:
+                fragment = next(rendered)
+                if key is not None:
+                    self.fragments[key] = fragment
+            fragments.append(fragment)
+        return fragments
+
+    def batch(self, *entry_lists):
+        """Render widgets for all entries in `entry_lists` at once. Returns a
+        callable taking an entry and returning its widget, suitable
+        for passing to page templates as `widget_render`"""
+        entries = [entry for entry_list in entry_lists
+                   for entry in entry_list]
+        by_id = dict(zip([id(entry) for entry in entries],
+                         self.render(entries)))
+
+        def widget_render(entry):
+            if id(entry) in by_id:
+                return by_id[id(entry)]
+            return self.render([entry])[0]
+        return widget_render